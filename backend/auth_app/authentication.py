@@ -0,0 +1,74 @@
+"""
+JWT authentication without a DB query on every request.
+CachedJWTAuthentication keeps users in cache for a short time (cleared when the user is saved, see signals.py).
+StatelessJWTAuthentication doesn't load the user at all, request.user is a TokenUser built from the token.
+It's for read-only endpoints that need only the id of the user (or nothing).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from kebab_spots_app.metrics import counters
+
+DEFAULTS = {
+    'CACHE': 'default',  # alias from CACHES, with locmem every worker process has its own copy
+    'TIMEOUT': 60,  # seconds, also how long other processes may see a deactivated user with locmem
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AUTH_USER_CACHE', {})}
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    config = get_config()
+    caches[config['CACHE']].delete(user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        config = get_config()
+        cache = caches[config['CACHE']]
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            counters.inc('auth.user_cache_misses')
+            # DB query + the same checks as in simplejwt
+            user = super().get_user(validated_token)
+            cache.set(user_cache_key(user_id), user, config['TIMEOUT'])
+            return user
+
+        counters.inc('auth.user_cache_hits')
+        # cached user is checked the same way as one loaded from DB
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        counters.inc('auth.stateless_users')
+        return user
+
+
+def auth_stats():
+    """Counters of this process. Every cache hit and stateless user is a user query that wasn't made."""
+    stats = counters.snapshot('auth.')
+    stats['auth.db_lookups_avoided'] = stats.get('auth.user_cache_hits', 0) + stats.get('auth.stateless_users', 0)
+    return stats
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_user
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # profile update, deactivation, new password: cached copy for authentication is outdated.
+    # Only last_login is changed on a session login (admin), the cached user doesn't need it
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    forget_user(instance.pk)
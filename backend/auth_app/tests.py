@@ -1,3 +1,43 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from kebab_spots_app.metrics import counters
+from .models import CustomUser
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        counters.reset()
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_user_is_loaded_from_db_once(self):
+        self.client.get(reverse('user_profile'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('user_profile'))
+        self.assertEqual(response.json()['username'], 'tester')
+        self.assertEqual(counters.get('auth.user_cache_hits'), 1)
+
+    def test_profile_update_and_deactivation_clear_cache(self):
+        self.client.get(reverse('user_profile'))
+        self.client.patch(reverse('user_profile'), {'city': 'Kyiv'})
+        self.assertEqual(self.client.get(reverse('user_profile')).json()['city'], 'Kyiv')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('user_profile')).status_code, 401)
+
+    def test_read_only_views_do_not_load_user(self):
+        with self.assertNumQueries(0):
+            self.client.get(reverse('spots'))
+        self.assertEqual(counters.get('auth.stateless_users'), 1)
+
+    def test_token_obtain_does_not_write_last_login(self):
+        serializer = TokenObtainPairSerializer(data={'username': 'tester', 'password': 'password'})
+        self.assertTrue(serializer.is_valid())
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
@@ -1,8 +1,12 @@
 from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .authentication import auth_stats
 from .models import CustomUser
 from .serializers import RegistrationSerializer, UserProfileSerializer, UserSpotsHistorySerializer
 from kebab_spots_app.models import KebabSpot
+from kebab_spots_app.pagination import KeysetPagination
 
 
 class RegistrationAPIVIew(generics.CreateAPIView):
@@ -30,6 +34,15 @@ class UserProfileAPIVIew(generics.RetrieveUpdateAPIView):
 class UserHistoryAPIView(generics.ListAPIView):
     serializer_class = UserSpotsHistorySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return KebabSpot.objects.filter(user=self.request.user)
+
+
+class AuthStatsAPIView(APIView):
+    """How often users were taken from cache or token instead of DB, in this worker process."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(auth_stats())
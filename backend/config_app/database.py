@@ -0,0 +1,29 @@
+"""
+OPTIONS of the database connections, built from environment variables in settings.
+psycopg_pool is imported only when the pool is on, so with DB_POOL=False it doesn't have to be installed.
+"""
+
+
+def database_options(environ):
+    options = {}
+    # Opt-in: with DB_PREPARE_THRESHOLD=<n> parameters are sent separately from SQL, so psycopg can prepare queries
+    # on the server: after n runs of the same query on a connection (spot list for example) it isn't parsed and planned
+    # again. Off by default: server-side binding limits a query to 65535 parameters (large bulk_create / __in),
+    # Django has known GROUP BY problems with it (region stats, clusters), and PgBouncer in transaction mode
+    # older than 1.21 doesn't support it
+    prepare_threshold = environ.get('DB_PREPARE_THRESHOLD', 'none')
+    if prepare_threshold != 'none':
+        options['server_side_binding'] = True
+        options['prepare_threshold'] = int(prepare_threshold)
+    if environ.get('DB_POOL', 'True') == 'True':
+        from psycopg_pool import ConnectionPool
+
+        options['pool'] = {
+            'min_size': int(environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(environ.get('DB_POOL_MAX_SIZE', '10')),
+            'timeout': float(environ.get('DB_POOL_TIMEOUT', '10')),  # seconds to wait for a free connection
+            'max_idle': 5 * 60,  # idle connections above min_size are closed after this time
+            'max_lifetime': 60 * 60,
+            'check': ConnectionPool.check_connection,  # broken connections are not given to requests
+        }
+    return options
@@ -0,0 +1,160 @@
+"""
+Read replicas.
+ReplicaMiddleware marks GET/HEAD/OPTIONS requests as read-only, and ReplicaRouter sends their reads
+to a random replica from DATABASE_REPLICAS['ALIASES']. Everything else (writes, POST requests,
+management commands, background jobs) uses the primary 'default' database.
+
+After a write request the client (token or IP) is pinned to the primary for PIN_SECONDS,
+so right after voting the client sees its own vote. Pins are kept in the cache, so with several
+worker processes a shared cache is needed for them.
+Replication lag is measured at most every LAG_CHECK_SECONDS per process; a replica that is
+further behind than MAX_LAG_SECONDS (or doesn't answer) is not used until it catches up.
+"""
+import hashlib
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connections
+
+DEFAULTS = {
+    'ALIASES': [],  # aliases from DATABASES
+    'PIN_SECONDS': 5,
+    'MAX_LAG_SECONDS': 2,
+    'LAG_CHECK_SECONDS': 1,
+    'CACHE': 'default',  # alias from CACHES for pins
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+LAG_QUERY = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+'''
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_REPLICAS', {})}
+
+
+# True while a read-only request is handled (this thread / asyncio task)
+read_only_request = ContextVar('read_only_request', default=False)
+
+
+class ReplicaLag:
+    """Last measured lag of every replica in this process."""
+
+    def __init__(self):
+        self.lag = {}  # alias -> (seconds or None if replica failed, time of the check)
+        self._lock = threading.Lock()
+
+    def is_usable(self, alias, config):
+        lag, checked = self.lag.get(alias, (None, 0))
+        if time.monotonic() - checked >= config['LAG_CHECK_SECONDS'] and self._lock.acquire(blocking=False):
+            # one thread checks, others use the last value meanwhile
+            try:
+                lag = self.measure(alias)
+                self.lag[alias] = (lag, time.monotonic())
+            finally:
+                self._lock.release()
+        return lag is not None and lag <= config['MAX_LAG_SECONDS']
+
+    def measure(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_QUERY)
+                return float(cursor.fetchone()[0])
+        except DatabaseError:
+            return None
+
+
+replica_lag = ReplicaLag()
+
+
+def _reset_lag(setting, **kwargs):
+    if setting == 'DATABASE_REPLICAS':
+        replica_lag.lag.clear()
+
+
+setting_changed.connect(_reset_lag)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not read_only_request.get():
+            return 'default'
+        config = get_config()
+        replicas = [alias for alias in config['ALIASES'] if replica_lag.is_usable(alias, config)]
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas have the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def client_key(request):
+    # the same client without a DB query: hash of the token, or IP for anonymous requests
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        return 'db:pin:' + hashlib.md5(authorization.encode()).hexdigest()
+    return f"db:pin:{request.META.get('REMOTE_ADDR')}"
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = get_config()
+        if not config['ALIASES']:
+            return self.get_response(request)
+        token = read_only_request.set(self.is_read_only(request, config))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_only_request.reset(token)
+        self.pin_after_write(request, response, config)
+        return response
+
+    async def __acall__(self, request):
+        config = get_config()
+        if not config['ALIASES']:
+            return await self.get_response(request)
+        token = read_only_request.set(self.is_read_only(request, config))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_only_request.reset(token)
+        self.pin_after_write(request, response, config)
+        return response
+
+    def is_read_only(self, request, config):
+        if request.method not in SAFE_METHODS:
+            return False
+        return not caches[config['CACHE']].get(client_key(request))
+
+    def pin_after_write(self, request, response, config):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            caches[config['CACHE']].set(client_key(request), True, config['PIN_SECONDS'])
@@ -2,8 +2,11 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 import os
+import sys
 import dj_database_url
 
+from config_app.database import database_options
+
 load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -20,6 +23,9 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
+# `manage.py test` is running
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '*').split(',')
 
 # Application definition
@@ -35,6 +41,7 @@ INSTALLED_APPS = [
     'cloudinary',
 
     'django.contrib.gis',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_gis',
     'rest_framework_simplejwt.token_blacklist',
@@ -46,9 +53,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'kebab_spots_app.performance.PerformanceMiddleware',  # first, so the time of other middleware is counted too
+    'config_app.replicas.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'config_app.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise that doesn't block async views
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,12 +99,53 @@ WSGI_APPLICATION = 'config_app.wsgi.application'
 #     }
 # }
 
+# psycopg connection pool in every worker process: connections (and PostGIS type lookups) are made once
+# and shared by the threads of the worker. Pool and persistent connections (conn_max_age) can't be used together
+DB_POOL = os.getenv('DB_POOL', 'True') == 'True'
+DB_OPTIONS = database_options(os.environ)  # prepared statements and the pool, config_app/database.py
+
 DATABASES = {
     'default': dj_database_url.config(
         default=os.getenv('DATABASE_URL'),
-        conn_max_age=600,
+        conn_max_age=0 if DB_POOL else 600,
+        engine='django.contrib.gis.db.backends.postgis'
+    )
+}
+DATABASES['default']['OPTIONS'] = {**DATABASES['default'].get('OPTIONS', {}), **DB_OPTIONS}
+
+# Read replicas, comma separated URLs. GET requests read from them (config_app/replicas.py)
+DATABASE_REPLICA_URLS = [url for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url]
+for number, url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    DATABASES[f'replica{number}'] = dj_database_url.parse(
+        url,
+        conn_max_age=0 if DB_POOL else 600,
         engine='django.contrib.gis.db.backends.postgis'
     )
+    DATABASES[f'replica{number}']['OPTIONS'] = {**DATABASES[f'replica{number}'].get('OPTIONS', {}), **DB_OPTIONS}
+    # in tests replicas are the test database itself
+    DATABASES[f'replica{number}']['TEST'] = {'MIRROR': 'default'}
+if not DATABASE_REPLICA_URLS and TESTING:
+    # tests of the router need a second database, in `manage.py test` it's a mirror of the test database
+    DATABASES['replica1'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['config_app.replicas.ReplicaRouter']
+DATABASE_REPLICAS = {
+    'ALIASES': [f'replica{number}' for number in range(1, len(DATABASE_REPLICA_URLS) + 1)],
+    'PIN_SECONDS': 5,  # client reads from primary after its write, so it sees its own changes
+    'MAX_LAG_SECONDS': 2,  # replica that is further behind is not used
+    'LAG_CHECK_SECONDS': 1,
+    'CACHE': 'default',  # alias from CACHES, pins need a shared cache with several workers
+}
+
+# Cache
+# Local memory by default, for several workers set shared cache, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://127.0.0.1:6379
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
 }
 
 # Password validation
@@ -180,7 +230,14 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',)
+    # users are taken from cache, read-only views use StatelessJWTAuthentication (auth_app/authentication.py)
+    'DEFAULT_AUTHENTICATION_CLASSES': ('auth_app.authentication.CachedJWTAuthentication',),
+    # views with throttle_scope are limited by THROTTLING rates (kebab_spots_app/throttling.py)
+    'DEFAULT_THROTTLE_CLASSES': ('kebab_spots_app.throttling.TokenBucketThrottle',),
+    'DEFAULT_RENDERER_CLASSES': (
+        'kebab_spots_app.performance.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -188,5 +245,81 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    'UPDATE_LAST_LOGIN': False,  # no UPDATE of the user row on every token obtain
+}
+
+# Requests per user (or IP) for views with throttle_scope, 429 with Retry-After when the limit is reached.
+# 'local' - limits of every worker process, 'cache' - common limits through CACHE (needs a shared cache)
+THROTTLING = {
+    'BACKEND': os.getenv('THROTTLING_BACKEND', 'local'),
+    'CACHE': 'default',  # alias from CACHES
+    'RATES': {
+        'rate': '30/min',
+        'complaint': '10/hour',
+        'create_spot': '20/hour',
+        'search': '60/min',  # may call Nominatim, which allows 1 request per second for all of us
+    },
+}
+
+# Users of JWT authentication are cached for this time, cleared when the user is saved
+AUTH_USER_CACHE = {
+    'CACHE': 'default',  # alias from CACHES
+    'TIMEOUT': 60,  # seconds
+}
+
+# Search by town name: in-memory LRU -> GeocodeCacheEntry table -> GazetteerPlace table -> Nominatim
+GEOCODING = {
+    'UPSTREAM': os.getenv('GEOCODING_UPSTREAM', 'kebab_spots_app.geocoding.NominatimGeocoder'),
+    'NOMINATIM_URL': 'https://nominatim.openstreetmap.org/search',
+    'USER_AGENT': 'KebabSpots/2.0 (ktm2142@gmail.com)',
+    'TIMEOUT': 5,  # seconds
+    'CONNECT_TIMEOUT': 2,  # seconds, async client only
+    'MAX_CONNECTIONS': 20,  # connection pool of the async client
+    'LRU_SIZE': 1024,
+    'CACHE_TTL': 30 * 24 * 60 * 60,  # seconds
+    'NEGATIVE_CACHE_TTL': 24 * 60 * 60,
+}
+
+# Vector tiles are cached until a spot inside them changes
+SPOT_TILE_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+# Responses of spot list and search, dropped only for map cells where a spot changed (kebab_spots_app/response_cache.py)
+SPOT_RESPONSE_CACHE = {
+    'CACHE': os.getenv('SPOT_RESPONSE_CACHE', 'default'),  # alias from CACHES
+    'TIMEOUT': 5 * 60,  # seconds
+    'CELL_DEGREES': 0.5,
+    'COORD_PRECISION': 3,
+}
+
+# Spot lists are paginated by cursor, page_size query param can't be bigger than max
+SPOTS_PAGE_SIZE = 100
+SPOTS_MAX_PAGE_SIZE = 500
+# ?stream=1 sends all spots in radius as one streamed FeatureCollection, rows are read from DB in chunks
+SPOTS_STREAM_CHUNK_SIZE = 2000
+SPOTS_STREAM_MAX_SPOTS = 100000
+
+# Async spot list and search (kebab_spots_app/async_views.py), needs an ASGI server (SERVER=uvicorn in Dockerfile)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
+# Request timings (Server-Timing header and /metrics), see kebab_spots_app/performance.py
+PERFORMANCE = {
+    'SAMPLE_RATE': float(os.getenv('PERFORMANCE_SAMPLE_RATE', '0.01')),  # 0 - off, 1 - every request
+    # Server-Timing header is public (query counts, DB and view timings), so it's off unless enabled
+    'SERVER_TIMING': os.getenv('PERFORMANCE_SERVER_TIMING', 'False') == 'True',
+    'QUERY_BUDGET': 20,
+    'LATENCY_BUDGET_MS': 500,
+    'VIEW_BUDGETS': {
+        'spot_detail': {'QUERY_BUDGET': 3},
+        'spots': {'QUERY_BUDGET': 3},
+    },
+    'METRICS_TOKEN': os.getenv('METRICS_TOKEN', ''),  # without it /metrics is only for staff users
+}
+
+# Uploaded photos are processed in background, see kebab_spots_app/photos.py
+PHOTO_PROCESSING = {
+    'BACKEND': os.getenv('PHOTO_PROCESSING_BACKEND', 'thread'),  # 'sync', 'thread' or 'db'
+    'WORKERS': 4,
+    'UPLOAD_DIR': 'kebab_spots/uploads',  # uploads waiting for processing, in the default storage
+    'THUMBNAIL_SIZES': (320, 960),
+    'WEBP_QUALITY': 80,
 }
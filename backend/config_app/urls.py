@@ -19,10 +19,13 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
 
+from kebab_spots_app.performance import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/auth/', include('auth_app.urls')),
     path('api/v1/kebab_spots/', include('kebab_spots_app.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
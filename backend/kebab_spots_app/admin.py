@@ -1,5 +1,5 @@
 from django.contrib.gis import admin
-from .models import KebabSpot, KebabSpotPhoto, KebabSpotComplaint
+from .models import KebabSpot, KebabSpotPhoto, KebabSpotComplaint, GeocodeCacheEntry, GazetteerPlace
 
 
 class KebabSpotPhotoInline(admin.TabularInline):
@@ -18,5 +18,17 @@ class KebabSpotAdmin(admin.GISModelAdmin):
     list_display = ['id', 'name', 'user', 'average_rating', 'hidden']
     list_display_links = ['id', 'name', 'user', 'hidden']
     search_fields = ['id', 'name', 'user__username']
-    readonly_fields = ['average_rating', 'ratings_count']
-    inlines = [KebabSpotPhotoInline, KebabSpotComplaintInline]
\ No newline at end of file
+    readonly_fields = ['average_rating', 'ratings_count', 'ratings_sum']
+    inlines = [KebabSpotPhotoInline, KebabSpotComplaintInline]
+
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'query', 'name', 'lat', 'lon', 'expires_at']
+    search_fields = ['query', 'name']
+
+
+@admin.register(GazetteerPlace)
+class GazetteerPlaceAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'normalized_name', 'country_code', 'population']
+    search_fields = ['name', 'normalized_name']
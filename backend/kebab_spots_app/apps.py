@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class KebabSpotsAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kebab_spots_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
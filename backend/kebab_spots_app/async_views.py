@@ -0,0 +1,124 @@
+"""
+Async versions of the spot list and search, used when settings.ASYNC_VIEWS is on (ASGI server, see Dockerfile).
+While a request waits for Nominatim or PostgreSQL, the event loop serves other requests,
+so one process handles many slow searches at once instead of one per worker.
+Parameters and responses are the same as in the sync views.
+"""
+import asyncio
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.http import JsonResponse
+from django.utils.http import quote_etag
+from django.views import View
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from .conditional import not_modified, set_validators
+from .geocoding import get_geocoder
+from .geojson import dumps, feature_collection, geojson_response, spot_rows
+from .mixins import FiltersMixin
+from .models import KebabSpot
+from .pagination import DistanceKeysetPagination
+from .response_cache import cache_response, get_cached_response, response_cache_key
+from .throttling import TokenBucketThrottle, get_limiter, retry_after
+from .views import NEAREST_PROPERTIES, READ_ONLY_AUTHENTICATION, ListKebabSpotsAPIView
+
+
+async def cached_page(request, cache_key, queryset, paginator, extra=None):
+    """Response of one page: 304, cached bytes or rows read with the async ORM."""
+    etag = quote_etag(cache_key)
+    response = not_modified(request, etag)
+    if response is None:
+        content = await sync_to_async(get_cached_response)(cache_key)
+        if content is None:
+            page = await paginator.apaginate_queryset(spot_rows(queryset, 'distance'), request)
+            # keys in the same order as the sync views: both fill the same cache key, so bytes must be equal
+            if extra:
+                data = {**extra, 'spots': feature_collection(page), 'next': paginator.get_next_link()}
+            else:
+                data = feature_collection(page, next=paginator.get_next_link())
+            content = dumps(data)
+            await sync_to_async(cache_response)(cache_key, content)
+        response = geojson_response(content)
+    return set_validators(response, etag)
+
+
+class AsyncAPIView(View):
+    """Plain Django async view (DRF views are sync only), DRF errors become JSON responses like in DRF."""
+    # the same as the sync views, user comes from the token without a query (throttling needs it)
+    authentication_classes = READ_ONLY_AUTHENTICATION
+
+    async def get(self, request):
+        try:
+            authenticators = [authentication() for authentication in self.authentication_classes]
+            return await self.respond(Request(request, authenticators=authenticators))
+        except APIException as error:
+            return JsonResponse(error.detail, status=error.status_code, safe=False)
+
+
+class AsyncListKebabSpotsView(AsyncAPIView):
+    """Async ListKebabSpotsAPIView. Query is built by the sync view class, rows are read with the async ORM."""
+
+    async def respond(self, request):
+        view = ListKebabSpotsAPIView(request=request, args=(), kwargs={}, format_kwarg=None)
+        queryset = view.get_queryset()
+
+        if queryset.query.is_empty():
+            return geojson_response(feature_collection([], next=None))
+        if view.is_nearest_mode():
+            rows = [row async for row in spot_rows(queryset, 'distance')[:view.nearest]]
+            return geojson_response(feature_collection(rows, properties=NEAREST_PROPERTIES))
+        if view.is_stream_mode():
+            # the router may check replication lag with a sync query
+            return await sync_to_async(view.stream)(queryset)
+
+        lat, lon = view.center
+        cache_key = await sync_to_async(response_cache_key)('spots', request, lat, lon, view.radius)
+        return await cached_page(request, cache_key, queryset, view.paginator)
+
+
+class AsyncSearchKebabSpotsView(FiltersMixin, AsyncAPIView):
+    """Async SearchKebabSpotsAPIView, Nominatim is called with httpx."""
+    throttle_scope = 'search'
+
+    async def respond(self, request):
+        self.request = request
+        throttle = TokenBucketThrottle()
+        if get_limiter().shared:
+            allowed = await sync_to_async(throttle.allow_request)(request, self)  # shared cache is network I/O
+        else:
+            allowed = throttle.allow_request(request, self)
+        if not allowed:
+            response = JsonResponse({'detail': 'Request was throttled.'}, status=429)
+            response['Retry-After'] = retry_after(throttle.wait())
+            return response
+        location_name = request.query_params.get('location')
+        if not location_name:
+            return JsonResponse({'error': 'Enter location'}, status=400)
+
+        try:
+            radius = float(request.query_params.get('radius', 5))
+            place = await get_geocoder().ageocode(location_name)
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            return JsonResponse({'error': 'Failed to connect to OSM'}, status=503)
+        except (ValueError, KeyError):
+            return JsonResponse({'error': 'invalid data received from OSM'}, status=500)
+        if place is None:
+            return JsonResponse({'error': 'Location not found'}, status=404)
+
+        center_point = Point(place.lon, place.lat, srid=4326)
+        nearby_spots = KebabSpot.objects.filter(
+            hidden=False,
+            coordinates__distance_lte=(center_point, D(km=radius))
+        ).annotate(distance=Distance('coordinates', center_point))
+        nearby_spots = self.apply_filters(nearby_spots)
+
+        cache_key = await sync_to_async(response_cache_key)(
+            'search', request, place.lat, place.lon, radius, location=place.name
+        )
+        location = {'location': {'name': place.name, 'lat': place.lat, 'lon': place.lon}}
+        return await cached_page(request, cache_key, nearby_spots, DistanceKeysetPagination(), extra=location)
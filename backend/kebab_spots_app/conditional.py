@@ -0,0 +1,26 @@
+"""
+Conditional GET: client sends back the ETag it got (If-None-Match) and gets empty 304 response
+if nothing has changed, so the spot isn't serialized and sent again.
+"""
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def spot_etag(pk, version, updated_at, user):
+    # detail has user_rating, so every user gets his own ETag
+    return quote_etag(f'{pk}-{version}-{updated_at.timestamp()}-{user.pk or 0}')
+
+
+def not_modified(request, etag, last_modified=None):
+    """Returns 304 response if client already has this version, otherwise None."""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # client must ask every time, but usually gets 304
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
@@ -0,0 +1,18 @@
+from django.contrib.gis.db import models as gis_models
+from django.db.models import FloatField, Func, Value
+
+
+class KNNDistance(Func):
+    """
+    PostGIS `<->` distance operator.
+    Unlike ST_Distance, ORDER BY with this operator + LIMIT is answered from the spatial index (KNN search):
+    PostGIS walks the index from the nearest entries and stops after LIMIT rows.
+    For geography columns the result is the distance in meters.
+    """
+    arg_joiner = ' <-> '
+    template = '(%(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, point, **extra):
+        point = Value(point, output_field=gis_models.GeometryField(srid=point.srid, geography=True))
+        super().__init__(expression, point, **extra)
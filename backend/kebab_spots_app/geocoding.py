@@ -0,0 +1,332 @@
+import asyncio
+import re
+import threading
+import time
+import unicodedata
+import weakref
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import counters
+from .models import GeocodeCacheEntry, GazetteerPlace
+from .performance import timed
+
+GeocodeResult = namedtuple('GeocodeResult', ['name', 'lat', 'lon'])
+
+DEFAULTS = {
+    'UPSTREAM': 'kebab_spots_app.geocoding.NominatimGeocoder',
+    'NOMINATIM_URL': 'https://nominatim.openstreetmap.org/search',
+    'USER_AGENT': 'KebabSpots/2.0 (ktm2142@gmail.com)',
+    'TIMEOUT': 5,
+    'CONNECT_TIMEOUT': 2,
+    'MAX_CONNECTIONS': 20,  # connection pool of async client
+    'LRU_SIZE': 1024,
+    'CACHE_TTL': 30 * 24 * 60 * 60,
+    'NEGATIVE_CACHE_TTL': 24 * 60 * 60,
+    'FAKE_PLACES': {},
+    'FAKE_DELAY': 0,
+}
+
+# marker for "we know this location doesn't exist", so not found results are cached too
+NOT_FOUND = GeocodeResult(None, None, None)
+
+MAX_QUERY_LENGTH = GeocodeCacheEntry._meta.get_field('query').max_length
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'GEOCODING', {})}
+
+
+def normalize_query(query):
+    """
+    "  Kyiv,Ukraine " and "kyiv, ukraine" must hit the same cache entry.
+    NFKC folds different unicode forms of the same letters, casefold() is lower() for all languages.
+    """
+    query = unicodedata.normalize('NFKC', query or '').casefold()
+    query = re.sub(r'\s*,\s*', ', ', query)
+    return re.sub(r'\s+', ' ', query).strip(' ,')
+
+
+class LRUCache:
+    """Bounded in-memory cache. The least recently used entry is dropped when it's full."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class NominatimGeocoder:
+    """
+    Remote geocoder. One requests.Session per process, so TCP/TLS connections are reused.
+    Async views use httpx.AsyncClient with its own connection pool (one per event loop).
+    """
+
+    def __init__(self, config):
+        self.url = config['NOMINATIM_URL']
+        self.timeout = config['TIMEOUT']
+        self.user_agent = config['USER_AGENT']
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = self.user_agent
+        self.async_timeout = httpx.Timeout(config['TIMEOUT'], connect=config['CONNECT_TIMEOUT'])
+        self.async_limits = httpx.Limits(max_connections=config['MAX_CONNECTIONS'])
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def geocode(self, query):
+        params = {
+            'q': query,
+            'format': 'json',
+            'limit': 1
+        }
+        with timed('http'):
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        return self._result(response.json())
+
+    async def ageocode(self, query):
+        params = {
+            'q': query,
+            'format': 'json',
+            'limit': 1
+        }
+        with timed('http'):
+            # httpx timeouts are per operation, the whole request must fit into TIMEOUT too
+            response = await asyncio.wait_for(self._client().get(self.url, params=params), self.timeout)
+        response.raise_for_status()
+        return self._result(response.json())
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(headers={'User-Agent': self.user_agent}, timeout=self.async_timeout,
+                                       limits=self.async_limits)
+            self._async_clients[loop] = client
+        return client
+
+    def _result(self, data):
+        if not data:
+            return None
+        return GeocodeResult(data[0].get('name'), float(data[0]['lat']), float(data[0]['lon']))
+
+
+class FakeGeocoder:
+    """
+    Local geocoder for tests and benchmarks, never goes to the network.
+    Places are taken from GEOCODING['FAKE_PLACES']: {'kyiv': ('Kyiv', 50.45, 30.52)}
+    """
+
+    def __init__(self, config):
+        self.places = {normalize_query(key): value for key, value in config['FAKE_PLACES'].items()}
+        self.delay = config['FAKE_DELAY']  # seconds, to imitate slow upstream in benchmarks
+        self.calls = 0
+
+    def geocode(self, query):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self._result(query)
+
+    async def ageocode(self, query):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self._result(query)
+
+    def _result(self, query):
+        place = self.places.get(normalize_query(query))
+        if place is None:
+            return None
+        return GeocodeResult(*place)
+
+
+class Geocoder:
+    """
+    Looks the location up in layers, from the cheapest to the most expensive:
+    1. LRU in process memory
+    2. GeocodeCacheEntry table (shared by all workers, entries have TTL)
+    3. GazetteerPlace table (offline towns list)
+    4. upstream geocoder (Nominatim), result is saved into both caches
+    """
+
+    def __init__(self, config=None):
+        config = config or get_config()
+        self.cache_ttl = config['CACHE_TTL']
+        self.negative_cache_ttl = config['NEGATIVE_CACHE_TTL']
+        self.lru = LRUCache(config['LRU_SIZE'])
+        self.upstream = import_string(config['UPSTREAM'])(config)
+
+    def geocode(self, query):
+        key = normalize_query(query)
+        if not key:
+            return None
+
+        result = self._from_memory(key) or self._from_db_layers(key)
+        if result is not None:
+            return self._found(result)
+
+        with self._upstream_call():
+            result = self.upstream.geocode(query)
+        self._remember(key, result or NOT_FOUND)
+        return result
+
+    async def ageocode(self, query):
+        """
+        The same for async views. Memory is checked right away, DB layers run in a thread,
+        and the upstream request is awaited, so a slow Nominatim doesn't hold a thread.
+        """
+        key = normalize_query(query)
+        if not key:
+            return None
+
+        result = self._from_memory(key) or await sync_to_async(self._from_db_layers)(key)
+        if result is not None:
+            return self._found(result)
+
+        with self._upstream_call():
+            if hasattr(self.upstream, 'ageocode'):
+                result = await self.upstream.ageocode(query)
+            else:
+                result = await sync_to_async(self.upstream.geocode)(query)
+        await sync_to_async(self._remember)(key, result or NOT_FOUND)
+        return result
+
+    def _from_memory(self, key):
+        result = self.lru.get(key)
+        if result is not None:
+            counters.inc('geocoding.lru_hits')
+        return result
+
+    def _from_db_layers(self, key):
+        result = self._from_db_cache(key)
+        if result is not None:
+            counters.inc('geocoding.db_cache_hits')
+            self.lru.set(key, result, self._ttl(result))
+            return result
+
+        result = self._from_gazetteer(key)
+        if result is not None:
+            counters.inc('geocoding.gazetteer_hits')
+            self._remember(key, result)
+        return result
+
+    @contextmanager
+    def _upstream_call(self):
+        counters.inc('geocoding.upstream_requests')
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            counters.inc('geocoding.upstream_errors')
+            raise
+        finally:
+            counters.inc('geocoding.upstream_seconds', time.perf_counter() - started)
+
+    def _found(self, result):
+        return None if result is NOT_FOUND else result
+
+    def _ttl(self, result):
+        return self.negative_cache_ttl if result is NOT_FOUND else self.cache_ttl
+
+    def _from_db_cache(self, key):
+        if len(key) > MAX_QUERY_LENGTH:
+            return None
+        entry = GeocodeCacheEntry.objects.filter(query=key, expires_at__gt=timezone.now()).first()
+        if entry is None:
+            return None
+        if entry.lat is None or entry.lon is None:
+            return NOT_FOUND
+        return GeocodeResult(entry.name, entry.lat, entry.lon)
+
+    def _from_gazetteer(self, key):
+        place = GazetteerPlace.objects.filter(normalized_name=key).order_by('-population').first()
+        if place is None:
+            return None
+        return GeocodeResult(place.name, place.lat, place.lon)
+
+    def _remember(self, key, result):
+        ttl = self._ttl(result)
+        self.lru.set(key, result, ttl)
+        if len(key) > MAX_QUERY_LENGTH:
+            return
+        GeocodeCacheEntry.objects.update_or_create(
+            query=key,
+            defaults={
+                'name': (result.name or '')[:255],
+                'lat': result.lat,
+                'lon': result.lon,
+                'expires_at': timezone.now() + timedelta(seconds=ttl),
+            }
+        )
+
+
+def geocoding_stats():
+    """Counters of this process plus rough estimate of upstream time saved by the caches."""
+    stats = counters.snapshot('geocoding.')
+    upstream_requests = stats.get('geocoding.upstream_requests', 0)
+    cache_hits = sum(stats.get(f'geocoding.{layer}_hits', 0) for layer in ('lru', 'db_cache', 'gazetteer'))
+    average_upstream = stats.get('geocoding.upstream_seconds', 0) / upstream_requests if upstream_requests else 0
+    stats['geocoding.hit_ratio'] = cache_hits / (cache_hits + upstream_requests) if cache_hits else 0
+    stats['geocoding.estimated_saved_seconds'] = cache_hits * average_upstream
+    return stats
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = Geocoder()
+    return _geocoder
+
+
+def _reset_geocoder(setting, **kwargs):
+    # override_settings(GEOCODING=...) in tests must build a new geocoder
+    global _geocoder
+    if setting == 'GEOCODING':
+        _geocoder = None
+
+
+setting_changed.connect(_reset_geocoder)
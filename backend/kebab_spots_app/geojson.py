@@ -0,0 +1,126 @@
+"""
+Fast GeoJSON output for spot lists.
+KebabSpotListSerializer (GeoFeatureModelSerializer) creates a model instance, a GEOS point and goes through
+DRF fields for every row. Here PostGIS gives lon/lat as plain numbers, rows come from .values(),
+and the FeatureCollection is built from dicts and dumped with one json.dumps call.
+The output is the same bytes DRF JSONRenderer produces for KebabSpotListSerializer.
+"""
+import json
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from django.contrib.gis.db import models as gis_models
+from django.db.models import FloatField, Func
+from django.db.models.functions import Cast
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .performance import timed
+
+# the same fields as KebabSpotListSerializer, without coordinates
+LIST_PROPERTIES = ('name', 'average_rating', 'ratings_count')
+RATING_PLACES = Decimal('0.1')
+
+
+def spot_rows(queryset, *extra):
+    """values() of the list fields + coordinates extracted by PostGIS. extra - annotations needed in rows."""
+    geometry = Cast('coordinates', output_field=gis_models.PointField(srid=4326))
+    return queryset.values(
+        'id', *LIST_PROPERTIES, *extra,
+        lon=Func(geometry, function='ST_X', output_field=FloatField()),
+        lat=Func(geometry, function='ST_Y', output_field=FloatField()),
+    )
+
+
+def coordinate(value):
+    # GDAL writes GeoJSON coordinates with 15 significant digits, do the same
+    return float(f'{value:.15g}')
+
+
+def spot_feature(row, properties=LIST_PROPERTIES):
+    values = {name: row[name] for name in properties}
+    if 'average_rating' in values:
+        # DRF DecimalField gives a string with exactly one decimal place
+        values['average_rating'] = f"{values['average_rating'].quantize(RATING_PLACES):f}"
+    if 'distance' in values:
+        values['distance'] = getattr(values['distance'], 'm', values['distance'])
+    return {
+        'id': row['id'],
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [coordinate(row['lon']), coordinate(row['lat'])]},
+        'properties': values,
+    }
+
+
+def feature_collection(rows, properties=LIST_PROPERTIES, **extra):
+    """extra keys (for example `next` link) go between "type" and "features", as pagination puts them."""
+    rows = list(rows)  # query runs here, so it's not counted as serializer time
+    with timed('serialize'):
+        return {
+            'type': 'FeatureCollection',
+            **extra,
+            'features': [spot_feature(row, properties) for row in rows],
+        }
+
+
+def dumps(data):
+    # the same settings as DRF JSONRenderer: compact, not escaped unicode, \u2028/\u2029 escaped for javascript
+    with timed('serialize'):
+        content = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        return content.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+def geojson_response(data, status=200):
+    # data can be already dumped bytes (from the response cache)
+    content = data if isinstance(data, bytes) else dumps(data)
+    return HttpResponse(content, content_type='application/json', status=status)
+
+
+STREAM_START = b'{"type":"FeatureCollection","features":['
+STREAM_END = b']}'
+
+
+def dump_features(rows, properties, first):
+    # one chunk of features, separated by commas; every chunk but the first starts with a comma
+    chunk = b','.join(dumps(spot_feature(row, properties)) for row in rows)
+    return chunk if first else b',' + chunk
+
+
+def stream_features(rows, properties, chunk_size):
+    """Yields bytes of a FeatureCollection. rows are read by a server-side cursor, chunk_size rows at a time."""
+    yield STREAM_START
+    first = True
+    buffer = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        buffer.append(row)
+        if len(buffer) >= chunk_size:
+            yield dump_features(buffer, properties, first)
+            first, buffer = False, []
+    if buffer:
+        yield dump_features(buffer, properties, first)
+    yield STREAM_END
+
+
+async def astream_features(rows, properties, chunk_size):
+    """
+    The same for ASGI. Django ASGI handler reads a sync iterator completely before sending it,
+    so under ASGI the response must get an async iterator.
+    """
+    yield STREAM_START
+    first = True
+    buffer = []
+    async for row in rows.aiterator(chunk_size=chunk_size):
+        buffer.append(row)
+        if len(buffer) >= chunk_size:
+            yield await sync_to_async(dump_features)(buffer, properties, first)
+            first, buffer = False, []
+    if buffer:
+        yield await sync_to_async(dump_features)(buffer, properties, first)
+    yield STREAM_END
+
+
+def geojson_streaming_response(rows, properties=LIST_PROPERTIES, is_async=False):
+    chunk_size = getattr(settings, 'SPOTS_STREAM_CHUNK_SIZE', 2000)
+    stream = astream_features if is_async else stream_features
+    return StreamingHttpResponse(stream(rows, properties, chunk_size), content_type='application/json')
@@ -0,0 +1,262 @@
+import json
+import math
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+from PIL import Image
+import django
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from auth_app.models import CustomUser
+from kebab_spots_app.models import AMENITIES, KebabSpot, KebabSpotPhoto, KebabSpotRating, amenities_to_mask
+
+CENTER = (30.5238, 50.45466)  # lon, lat
+TOWN = 'Benchtown'
+SCENARIOS = ('list', 'search', 'detail', 'rate', 'complaint')
+PHOTO_NAME = 'kebab_spots/benchmark.webp'
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def summary(latencies, queries, errors, seconds=None):
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+    }
+    if queries is not None:
+        result['queries_per_request'] = round(sum(queries) / len(queries), 2) if queries else None
+    if seconds is not None:
+        result['throughput_rps'] = round(len(latencies) / seconds, 1) if seconds else None
+    return result
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the API on a generated dataset in a separate test database. '
+            'Prints JSON with p50/p95/p99 latency, queries per request and throughput of every endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spots', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--ratings-per-spot', type=int, default=5)
+        parser.add_argument('--photos-per-spot', type=int, default=2)
+        parser.add_argument('--requests', type=int, default=200, help='Sequential requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads of the load generator, 0 - skip')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of load per endpoint')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--no-response-cache', action='store_true', help='Measure list/search without cache')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+        parser.add_argument('--output', help='Write JSON to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        media = tempfile.TemporaryDirectory()
+        overrides = override_settings(
+            ALLOWED_HOSTS=['*'],
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            MEDIA_ROOT=media.name,
+            GEOCODING={
+                'UPSTREAM': 'kebab_spots_app.geocoding.FakeGeocoder',
+                'FAKE_PLACES': {TOWN: (TOWN, CENTER[1], CENTER[0])},
+            },
+            SPOT_RESPONSE_CACHE={
+                **getattr(settings, 'SPOT_RESPONSE_CACHE', {}),
+                'ENABLED': not options['no_response_cache'],
+            },
+            PHOTO_PROCESSING={**getattr(settings, 'PHOTO_PROCESSING', {}), 'BACKEND': 'sync'},
+            THROTTLING={**getattr(settings, 'THROTTLING', {}), 'ENABLED': False},  # benchmark users are much faster than real ones
+        )
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with overrides:
+                started = time.perf_counter()
+                self.create_dataset(options, media.name)
+                dataset_seconds = time.perf_counter() - started
+
+                results = {}
+                for scenario in options['scenarios']:
+                    self.stderr.write(f'Benchmarking {scenario}...')
+                    results[scenario] = {'sequential': self.run_sequential(scenario, options['requests'])}
+                    if options['concurrency']:
+                        results[scenario]['concurrent'] = self.run_concurrent(
+                            scenario, options['concurrency'], options['duration']
+                        )
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            media.cleanup()
+
+        report = {
+            'meta': {
+                'commit': self.git_commit(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'seed': options['seed'],
+                'dataset': {
+                    'spots': options['spots'],
+                    'users': options['users'],
+                    'ratings_per_spot': options['ratings_per_spot'],
+                    'photos_per_spot': options['photos_per_spot'],
+                    'seconds': round(dataset_seconds, 2),
+                },
+                'concurrency': options['concurrency'],
+                'response_cache': not options['no_response_cache'],
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def create_dataset(self, options, media_root):
+        if options['keepdb']:
+            call_command('flush', interactive=False, verbosity=0)  # tables are kept, old data is not
+        photo_path = Path(media_root) / PHOTO_NAME
+        photo_path.parent.mkdir(parents=True)
+        Image.new('RGB', (64, 64), 'orange').save(photo_path, format='WEBP')
+
+        self.users = CustomUser.objects.bulk_create(
+            CustomUser(username=f'bench{i}', password='!') for i in range(options['users'])
+        )
+        ratings_per_spot = min(options['ratings_per_spot'], len(self.users))
+
+        spots = []
+        votes = []
+        for i in range(options['spots']):
+            amenities = [amenity for amenity in AMENITIES if self.random.random() < 0.3]
+            values = [self.random.randint(1, 5) for _ in range(ratings_per_spot)]
+            spots.append(KebabSpot(
+                user=self.random.choice(self.users),
+                name=f'Spot {i}',
+                coordinates=self.random_point(self.random, radius_km=50),
+                ratings_sum=sum(values),
+                ratings_count=len(values),
+                average_rating=round(Decimal(sum(values)) / len(values), 1) if values else 0,
+                amenities_mask=amenities_to_mask(amenities),  # bulk_create doesn't call save()
+                **{amenity: True for amenity in amenities},
+            ))
+            votes.append(values)
+        self.spots = KebabSpot.objects.bulk_create(spots, batch_size=2000)
+
+        KebabSpotRating.objects.bulk_create(
+            (
+                KebabSpotRating(spot=spot, user=user, value=value)
+                for spot, values in zip(self.spots, votes)
+                for user, value in zip(self.random.sample(self.users, len(values)), values)
+            ),
+            batch_size=5000,
+        )
+        KebabSpotPhoto.objects.bulk_create(
+            (
+                KebabSpotPhoto(spot=spot, user=spot.user, photo=PHOTO_NAME, thumbnails={'320': PHOTO_NAME})
+                for spot in self.spots
+                for _ in range(options['photos_per_spot'])
+            ),
+            batch_size=5000,
+        )
+        self.complaint_lock = threading.Lock()
+        self.complaints_left = [(spot.pk, user) for spot in self.spots[:1000] for user in self.users[:4]]
+        self.random.shuffle(self.complaints_left)
+
+    def random_point(self, rng, radius_km):
+        lon, lat = CENTER
+        distance = radius_km * math.sqrt(rng.random()) / 111.32
+        angle = rng.uniform(0, 2 * math.pi)
+        return Point(lon + distance * math.cos(angle) / math.cos(math.radians(lat)),
+                     lat + distance * math.sin(angle), srid=4326)
+
+    def request(self, scenario, client, rng):
+        """Makes one request of the scenario, returns the response."""
+        if scenario == 'list':
+            point = self.random_point(rng, radius_km=40)
+            return client.get(reverse('spots'), {'lat': round(point.y, 3), 'lon': round(point.x, 3), 'radius': 10})
+        if scenario == 'search':
+            return client.get(reverse('search'), {'location': TOWN, 'radius': rng.choice([5, 10, 20])})
+        if scenario == 'detail':
+            return client.get(reverse('spot_detail', kwargs={'pk': rng.choice(self.spots).pk}))
+
+        if scenario == 'rate':
+            client.force_authenticate(rng.choice(self.users))
+            return client.post(reverse('rate_spot', kwargs={'pk': rng.choice(self.spots).pk}),
+                               {'value': rng.randint(1, 5)})
+        # complaint: every user can complain only once about a spot, so pairs are taken from a prepared list
+        with self.complaint_lock:
+            pair = self.complaints_left.pop() if self.complaints_left else None
+        spot_id, user = pair or (rng.choice(self.spots).pk, rng.choice(self.users))
+        client.force_authenticate(user)
+        return client.post(reverse('complaint', kwargs={'pk': spot_id}), {'reason': 'benchmark'})
+
+    def run_sequential(self, scenario, count):
+        client = APIClient()
+        rng = random.Random(self.random.random())
+        latencies, queries, errors = [], [], 0
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = self.request(scenario, client, rng)
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+        return summary(latencies, queries, errors)
+
+    def run_concurrent(self, scenario, concurrency, duration):
+        deadline = time.perf_counter() + duration
+
+        def worker(seed):
+            client = APIClient()
+            rng = random.Random(seed)
+            latencies, errors = [], 0
+            try:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    response = self.request(scenario, client, rng)
+                    latencies.append(time.perf_counter() - started)
+                    errors += response.status_code >= 400
+            finally:
+                connections.close_all()  # every thread has its own DB connection
+            return latencies, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(worker, [self.random.random() for _ in range(concurrency)]))
+        seconds = time.perf_counter() - started
+        latencies = [latency for thread_latencies, _ in results for latency in thread_latencies]
+        return summary(latencies, None, sum(errors for _, errors in results), seconds)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,155 @@
+import json
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import setup_test_environment
+
+from auth_app.models import CustomUser
+from kebab_spots_app.geojson import spot_rows
+from kebab_spots_app.management.commands.benchmark_api import CENTER, percentile
+from kebab_spots_app.models import KebabSpot
+
+# connection settings that are compared, the rest is taken from the default database
+MODES = {
+    # new connection for every request, as with conn_max_age=0 and no pool
+    'no_pool': {'CONN_MAX_AGE': 0, 'OPTIONS': {}},
+    # every thread keeps its own connection (conn_max_age=600 before the pool)
+    'persistent': {'CONN_MAX_AGE': 600, 'OPTIONS': {}},
+    'pool': {'CONN_MAX_AGE': 0, 'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10}}},
+    'pool_prepared': {
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {'pool': {'min_size': 2, 'max_size': 10}, 'server_side_binding': True, 'prepare_threshold': 5},
+    },
+}
+
+
+def summary_ms(values):
+    values = sorted(values)
+    return {
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Compare connection acquisition and spot list query latency without pool, with persistent connections, '
+            'with psycopg pool and with pool + prepared statements, under concurrent load in a test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spots', type=int, default=10000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per thread')
+        parser.add_argument('--queries', type=int, default=3, help='List queries per request')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        results = {}
+        try:
+            self.create_dataset(options)
+            for mode in options['modes']:
+                self.stderr.write(f'Benchmarking {mode}...')
+                results[mode] = self.run(mode, options)
+        finally:
+            for mode in options['modes']:
+                alias = f'benchmark_{mode}'
+                if alias in connections:
+                    connections[alias].close()
+                    connections[alias].close_pool()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        self.stdout.write(json.dumps({
+            'spots': options['spots'],
+            'threads': options['threads'],
+            'requests_per_thread': options['requests'],
+            'queries_per_request': options['queries'],
+            'results': results,
+        }, indent=2))
+
+    def create_dataset(self, options):
+        if options['keepdb']:
+            call_command('flush', interactive=False, verbosity=0)
+        user = CustomUser.objects.create(username='bench', password='!')
+        lon, lat = CENTER
+        spots = []
+        for i in range(options['spots']):
+            distance = 0.5 * math.sqrt(self.random.random())
+            angle = self.random.uniform(0, 2 * math.pi)
+            spots.append(KebabSpot(user=user, name=f'Spot {i}', coordinates=Point(
+                lon + distance * math.cos(angle), lat + distance * math.sin(angle), srid=4326)))
+        KebabSpot.objects.bulk_create(spots, batch_size=2000)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {KebabSpot._meta.db_table}')
+
+    def add_alias(self, mode):
+        # settings of the test database with options of the mode
+        alias = f'benchmark_{mode}'
+        settings_dict = {**connection.settings_dict, **MODES[mode]}
+        settings_dict['OPTIONS'] = {**MODES[mode]['OPTIONS']}
+        connections.settings[alias] = settings_dict
+        return alias
+
+    def list_query(self, alias, rng):
+        # the same query as the spot list page (ListKebabSpotsAPIView)
+        lon, lat = CENTER
+        center = Point(lon + rng.uniform(-0.2, 0.2), lat + rng.uniform(-0.2, 0.2), srid=4326)
+        queryset = (KebabSpot.objects.using(alias)
+                    .filter(hidden=False, coordinates__distance_lte=(center, D(km=10)))
+                    .annotate(distance=Distance('coordinates', center))
+                    .order_by('distance', 'id'))
+        return list(spot_rows(queryset, 'distance')[:101])
+
+    def run(self, mode, options):
+        alias = self.add_alias(mode)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            db = connections[alias]
+            acquire, queries, requests = [], [], []
+            try:
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    db.ensure_connection()  # connect, or take a connection from the pool
+                    connected = time.perf_counter()
+                    for _ in range(options['queries']):
+                        query_started = time.perf_counter()
+                        self.list_query(alias, rng)
+                        queries.append(time.perf_counter() - query_started)
+                    # end of the request: the same as Django does on request_finished
+                    db.close_if_unusable_or_obsolete()
+                    acquire.append(connected - started)
+                    requests.append(time.perf_counter() - started)
+            finally:
+                db.close()
+            return acquire, queries, requests
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(worker, [self.random.random() for _ in range(options['threads'])]))
+        seconds = time.perf_counter() - started
+
+        acquire = [value for thread in results for value in thread[0]]
+        queries = [value for thread in results for value in thread[1]]
+        requests = [value for thread in results for value in thread[2]]
+        return {
+            'acquire': summary_ms(acquire),
+            'query': summary_ms(queries),
+            'request': summary_ms(requests),
+            'throughput_rps': round(len(requests) / seconds, 1),
+        }
@@ -0,0 +1,76 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from kebab_spots_app.geojson import dumps, feature_collection
+from kebab_spots_app.models import KebabSpot
+from kebab_spots_app.serializers import KebabSpotListSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF KebabSpotListSerializer with the fast GeoJSON path on generated spots (DB is not used)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='Numbers of spots')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size, the best one is reported')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        for size in options['sizes']:
+            rows = self.make_rows(size)
+            spots = [
+                KebabSpot(id=row['id'], name=row['name'], average_rating=row['average_rating'],
+                          ratings_count=row['ratings_count'], coordinates=Point(row['lon'], row['lat'], srid=4326))
+                for row in rows
+            ]
+
+            drf_seconds, drf_bytes = self.best_of(options['repeat'], lambda: JSONRenderer().render(
+                KebabSpotListSerializer(spots, many=True).data
+            ))
+            fast_seconds, fast_bytes = self.best_of(options['repeat'], lambda: dumps(feature_collection(rows)))
+
+            results.append({
+                'spots': size,
+                'drf_ms': round(drf_seconds * 1000, 2),
+                'fast_ms': round(fast_seconds * 1000, 2),
+                'speedup': round(drf_seconds / fast_seconds, 1),
+                'same_output': drf_bytes == fast_bytes,
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        for result in results:
+            self.stdout.write(
+                f"{result['spots']} spots: DRF {result['drf_ms']} ms, fast {result['fast_ms']} ms "
+                f"(x{result['speedup']}), same output: {result['same_output']}"
+            )
+
+    def make_rows(self, size):
+        generator = random.Random(size)  # the same spots every run
+        return [
+            {
+                'id': i + 1,
+                'name': f'Spot {i}',
+                'average_rating': Decimal(generator.randint(0, 50)) / 10,
+                'ratings_count': generator.randint(0, 500),
+                'lon': generator.uniform(22, 40),
+                'lat': generator.uniform(44, 52),
+            }
+            for i in range(size)
+        ]
+
+    def best_of(self, repeat, func):
+        best, output = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
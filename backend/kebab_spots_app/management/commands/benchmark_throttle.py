@@ -0,0 +1,93 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import ScopedRateThrottle
+
+from kebab_spots_app.throttling import TokenBucketThrottle
+
+SCOPE = 'benchmark'
+
+
+class BenchmarkView:
+    throttle_scope = SCOPE
+
+
+class DRFScopedThrottle(ScopedRateThrottle):
+    """DRF's own throttle (list of request times in cache), for comparison."""
+    THROTTLE_RATES = {}
+
+
+class Command(BaseCommand):
+    help = ('Measure the cost of one throttle check (allow_request) in microseconds: local token buckets, '
+            'shared cache counters and DRF ScopedRateThrottle for comparison. DB is not used')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=100000, help='Checks per thread')
+        parser.add_argument('--keys', type=int, default=1000, help='Different clients (IPs)')
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+        parser.add_argument('--rate', default='1000/s', help='Limit of every client')
+        parser.add_argument('--cache', default='default', help='Alias from CACHES for the shared backend')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        # requests are built once, only the check itself is measured
+        requests = [Request(factory.get('/', REMOTE_ADDR=f'10.0.{i // 256 % 256}.{i % 256}'))
+                    for i in range(options['keys'])]
+        for request in requests:
+            request.user  # anonymous user is resolved here, not during the measurement
+
+        rates = {SCOPE: options['rate']}
+        DRFScopedThrottle.THROTTLE_RATES = rates
+        backends = {
+            'local': {'BACKEND': 'local', 'RATES': rates},
+            'cache': {'BACKEND': 'cache', 'CACHE': options['cache'], 'RATES': rates},
+            'drf_scoped': None,
+        }
+
+        results = {}
+        for name, config in backends.items():
+            throttling = {**getattr(settings, 'THROTTLING', {}), **(config or {}), 'ENABLED': True}
+            throttle_class = DRFScopedThrottle if config is None else TokenBucketThrottle
+            with override_settings(THROTTLING=throttling):
+                results[name] = {
+                    threads: self.run(throttle_class, requests, options['calls'], threads)
+                    for threads in options['threads']
+                }
+
+        self.stdout.write(json.dumps({
+            'calls_per_thread': options['calls'],
+            'keys': options['keys'],
+            'rate': options['rate'],
+            'cache_backend': settings.CACHES[options['cache']]['BACKEND'],
+            'results': results,
+        }, indent=2))
+
+    def run(self, throttle_class, requests, calls, threads):
+        view = BenchmarkView()
+
+        def worker(offset):
+            throttle = throttle_class()
+            denied = 0
+            started = time.perf_counter()
+            for i in range(calls):
+                if not throttle.allow_request(requests[(offset + i) % len(requests)], view):
+                    denied += 1
+            return time.perf_counter() - started, denied
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            started = time.perf_counter()
+            results = list(executor.map(worker, range(threads)))
+            wall = time.perf_counter() - started
+
+        total_calls = calls * threads
+        return {
+            'us_per_check': round(sum(seconds for seconds, _ in results) / total_calls * 1e6, 2),
+            'checks_per_second': round(total_calls / wall),
+            'denied': sum(denied for _, denied in results),
+        }
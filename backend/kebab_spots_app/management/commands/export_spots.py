@@ -0,0 +1,73 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from kebab_spots_app.models import AMENITIES, KebabSpot
+from kebab_spots_app.spot_files import FORMATS, guess_format, write_spots
+
+SPOT_TABLE = KebabSpot._meta.db_table
+
+
+class Command(BaseCommand):
+    help = ('Export spots to GeoJSON/NDJSON/CSV. Rows are read by a server-side cursor (CSV straight from COPY), '
+            'so the table is never loaded into memory')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' for stdout")
+        parser.add_argument('--format', choices=FORMATS, help='Guessed from file extension by default')
+        parser.add_argument('--include-hidden', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or guess_format(options['path'])
+        if file_format not in FORMATS:
+            raise CommandError('Unknown file format, use --format')
+
+        path = options['path']
+        binary = file_format == 'csv'  # CSV from COPY comes as bytes
+        if path == '-':
+            file = sys.stdout.buffer if binary else sys.stdout
+        else:
+            file = open(path, 'wb') if binary else open(path, 'w', encoding='utf-8')
+        try:
+            if binary:
+                count = self.copy_csv(file, options['include_hidden'])
+            else:
+                count = write_spots(self.rows(options), file, file_format)
+        finally:
+            if path != '-':
+                file.close()
+        # stdout may be the exported file itself
+        self.stderr.write(self.style.SUCCESS(f'{count} spots exported'))
+
+    def rows(self, options):
+        spots = KebabSpot.objects.order_by('id')
+        if not options['include_hidden']:
+            spots = spots.filter(hidden=False)
+        for spot in spots.iterator(chunk_size=options['chunk_size']):
+            yield {
+                'id': spot.id,
+                'name': spot.name,
+                'lat': spot.coordinates.y,
+                'lon': spot.coordinates.x,
+                'description': spot.description,
+                **{amenity: getattr(spot, amenity) for amenity in AMENITIES},
+            }
+
+    def copy_csv(self, file, include_hidden):
+        where = '' if include_hidden else 'WHERE NOT hidden'
+        query = f'''
+            COPY (
+                SELECT id, name, ST_Y(coordinates::geometry) AS lat, ST_X(coordinates::geometry) AS lon, description,
+                       {', '.join(AMENITIES)}
+                FROM {SPOT_TABLE} {where}
+                ORDER BY id
+            ) TO STDOUT WITH (FORMAT csv, HEADER true)
+        '''
+        # cursor.cursor is psycopg cursor under Django wrapper
+        with connection.cursor() as cursor:
+            with cursor.cursor.copy(query) as copy:
+                for data in copy:
+                    file.write(data)
+            return cursor.cursor.rowcount  # COPY reports how many rows it sent
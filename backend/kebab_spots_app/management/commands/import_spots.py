@@ -0,0 +1,191 @@
+import sys
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from auth_app.models import CustomUser
+from kebab_spots_app.models import AMENITIES, KebabSpot, KebabSpotChange, RegionStats, amenities_to_mask
+from kebab_spots_app.response_cache import invalidate_responses
+from kebab_spots_app.spot_files import FORMATS, guess_format, is_true, read_spots
+from kebab_spots_app.tiles import invalidate_tiles
+
+SPOT_TABLE = KebabSpot._meta.db_table
+NAME_LENGTH = KebabSpot._meta.get_field('name').max_length
+AMENITY_COLUMNS = ', '.join(AMENITIES)
+
+# fields filled by the import itself, all other columns get their model defaults
+IMPORTED_FIELDS = {'id', 'coordinates', 'user', 'name', 'description', 'created_at', 'updated_at', 'amenities_mask',
+                   *AMENITIES}
+
+CREATE_STAGING = f'''
+CREATE TEMP TABLE spot_import (
+    row_number bigint PRIMARY KEY,
+    name text NOT NULL,
+    description text NOT NULL,
+    coordinates geography(Point, 4326) NOT NULL,
+    amenities_mask integer NOT NULL,
+    {', '.join(f'{amenity} boolean NOT NULL' for amenity in AMENITIES)},
+    spot_id bigint
+) ON COMMIT DROP
+'''
+
+# ids from the file (exported files have them) are used only if such spots exist
+FORGET_UNKNOWN_IDS = f'''
+UPDATE spot_import SET spot_id = NULL
+WHERE spot_id IS NOT NULL AND NOT EXISTS (SELECT FROM {SPOT_TABLE} spot WHERE spot.id = spot_import.spot_id)
+'''
+
+# the same name close to an earlier row of the file is a duplicate, rows with an id are kept
+REMOVE_FILE_DUPLICATES = '''
+DELETE FROM spot_import later USING spot_import earlier
+WHERE later.row_number > earlier.row_number
+  AND later.spot_id IS NULL
+  AND lower(later.name) = lower(earlier.name)
+  AND ST_DWithin(later.coordinates, earlier.coordinates, %(meters)s)
+'''
+
+# the same name close to a spot that is already in DB updates that spot
+MATCH_EXISTING = f'''
+UPDATE spot_import SET spot_id = (
+    SELECT spot.id FROM {SPOT_TABLE} spot
+    WHERE lower(spot.name) = lower(spot_import.name)
+      AND ST_DWithin(spot.coordinates, spot_import.coordinates, %(meters)s)
+    ORDER BY spot.coordinates <-> spot_import.coordinates
+    LIMIT 1
+)
+WHERE spot_id IS NULL
+'''
+
+# amenities from the file are added, nothing is taken away; description is replaced only by a non-empty one
+UPDATE_EXISTING = f'''
+UPDATE {SPOT_TABLE} spot SET
+    description = COALESCE(NULLIF(spot_import.description, ''), spot.description),
+    {', '.join(f'{amenity} = spot.{amenity} OR spot_import.{amenity}' for amenity in AMENITIES)},
+    amenities_mask = spot.amenities_mask | spot_import.amenities_mask,
+    version = spot.version + 1,
+    updated_at = now()
+FROM spot_import
+WHERE spot.id = spot_import.spot_id
+RETURNING spot.id, ST_X(spot.coordinates::geometry), ST_Y(spot.coordinates::geometry)
+'''
+
+
+class Command(BaseCommand):
+    help = ('Import spots from GeoJSON/NDJSON/CSV. Rows are copied into a temporary table with COPY, '
+            'duplicates (the same name within --dedupe-meters) and rows with an id of an existing spot are merged '
+            'into that spot, then spots are inserted/updated with a few SQL statements')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Guessed from file extension by default')
+        parser.add_argument('--user', required=True, help='Username of the author of new spots')
+        parser.add_argument('--dedupe-meters', type=float, default=50)
+        parser.add_argument('--progress-every', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or guess_format(options['path'])
+        if file_format not in FORMATS:
+            raise CommandError('Unknown file format, use --format')
+        try:
+            user = CustomUser.objects.get(username=options['user'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+
+        meters = {'meters': options['dedupe_meters']}
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING)
+            copied, skipped = self.copy_rows(cursor, options['path'], file_format, options['progress_every'])
+            self.stdout.write(f'{copied} rows copied, {skipped} invalid rows skipped')
+
+            cursor.execute('CREATE INDEX ON spot_import USING gist (coordinates)')
+            cursor.execute('ANALYZE spot_import')
+            cursor.execute(FORGET_UNKNOWN_IDS)
+            cursor.execute(REMOVE_FILE_DUPLICATES, meters)
+            self.stdout.write(f'{cursor.rowcount} duplicates inside the file removed')
+
+            cursor.execute(MATCH_EXISTING, meters)
+            cursor.execute(UPDATE_EXISTING)
+            updated = cursor.fetchall()
+            self.stdout.write(f'{len(updated)} existing spots updated')
+
+            created = self.insert_new(cursor, user)
+            self.stdout.write(f'{len(created)} spots created')
+
+            # raw SQL doesn't send signals, so caches and change log are updated here
+            changed = updated + created
+            KebabSpotChange.record(*(spot_id for spot_id, _, _ in changed))
+            # amenities of updated spots are merged in SQL, so region totals are counted again in one pass
+            RegionStats.rebuild()
+            points = [Point(lon, lat, srid=4326) for _, lon, lat in changed]
+            transaction.on_commit(lambda: self.invalidate(points))
+
+        self.stdout.write(self.style.SUCCESS(f'Import finished: {len(created)} created, {len(updated)} updated'))
+
+    def copy_rows(self, cursor, path, file_format, progress_every):
+        copied = skipped = 0
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        columns = f'row_number, spot_id, name, description, coordinates, amenities_mask, {AMENITY_COLUMNS}'
+        try:
+            # cursor.cursor is psycopg cursor under Django wrapper
+            with cursor.cursor.copy(f'COPY spot_import ({columns}) FROM STDIN') as copy:
+                for spot in read_spots(file, file_format):
+                    row = self.staging_row(spot, copied + 1)
+                    if row is None:
+                        skipped += 1
+                        continue
+                    copy.write_row(row)
+                    copied += 1
+                    if copied % progress_every == 0:
+                        self.stdout.write(f'{copied} rows copied...')
+        except (ValueError, KeyError, TypeError) as error:
+            raise CommandError(f'Can not read {path}: {error}')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        return copied, skipped
+
+    def staging_row(self, spot, row_number):
+        """Tuple for COPY, or None if the row is not a valid spot."""
+        try:
+            name = str(spot.get('name') or '').strip()[:NAME_LENGTH]
+            lat, lon = float(spot['lat']), float(spot['lon'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not name or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None
+        try:
+            spot_id = int(spot['id']) if spot.get('id') not in (None, '') else None
+        except (TypeError, ValueError):
+            spot_id = None
+        amenities = [is_true(spot.get(amenity)) for amenity in AMENITIES]
+        return (
+            row_number,
+            spot_id,
+            name,
+            str(spot.get('description') or ''),
+            f'SRID=4326;POINT({lon} {lat})',
+            amenities_to_mask(amenity for amenity, value in zip(AMENITIES, amenities) if value),
+            *amenities,
+        )
+
+    def insert_new(self, cursor, user):
+        # raw INSERT doesn't know model defaults (they are not DB defaults), so they are passed as parameters
+        defaults = [field for field in KebabSpot._meta.concrete_fields
+                    if field.name not in IMPORTED_FIELDS and not field.generated]
+        columns = ', '.join(field.column for field in defaults)
+        placeholders = ', '.join(['%s'] * len(defaults))
+        cursor.execute(f'''
+            INSERT INTO {SPOT_TABLE} (coordinates, user_id, name, description, created_at, updated_at,
+                                      amenities_mask, {AMENITY_COLUMNS}, {columns})
+            SELECT coordinates, %s, name, description, now(), now(), amenities_mask, {AMENITY_COLUMNS}, {placeholders}
+            FROM spot_import
+            WHERE spot_id IS NULL
+            ORDER BY row_number
+            RETURNING id, ST_X(coordinates::geometry), ST_Y(coordinates::geometry)
+        ''', [user.pk, *(field.get_default() for field in defaults)])
+        return cursor.fetchall()
+
+    def invalidate(self, points):
+        invalidate_responses(*points)
+        invalidate_tiles(*points)
@@ -0,0 +1,97 @@
+import csv
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from kebab_spots_app.geocoding import normalize_query
+from kebab_spots_app.models import GazetteerPlace
+
+DEFAULT_FILE = Path(__file__).resolve().parents[2] / 'data' / 'gazetteer.tsv'
+
+# columns of GeoNames dumps (https://download.geonames.org/export/dump/readme.txt)
+GEONAME_ID, NAME, ASCII_NAME, ALTERNATE_NAMES, LATITUDE, LONGITUDE, FEATURE_CLASS = range(7)
+COUNTRY_CODE = 8
+POPULATION = 14
+
+
+class Command(BaseCommand):
+    help = 'Load offline gazetteer used by the search before going to Nominatim (GeoNames tab separated format)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_FILE),
+                            help='GeoNames file, for example cities15000.txt. Bundled file is used by default')
+        parser.add_argument('--countries', default='', help='Comma separated country codes to load, e.g. UA,PL')
+        parser.add_argument('--min-population', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--replace', action='store_true', help='Delete existing places before loading')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'File {path} does not exist')
+
+        countries = {code.strip().upper() for code in options['countries'].split(',') if code.strip()}
+        batch_size = options['batch_size']
+        batch = []
+        places = 0
+        rows = 0
+
+        with transaction.atomic():
+            if options['replace']:
+                GazetteerPlace.objects.all().delete()
+
+            with path.open(encoding='utf-8', newline='') as file:
+                reader = csv.reader(file, delimiter='\t', quoting=csv.QUOTE_NONE)
+                for line in reader:
+                    place_rows = self.parse_line(line, countries, options['min_population'])
+                    if not place_rows:
+                        continue
+                    places += 1
+                    batch.extend(place_rows)
+                    if len(batch) >= batch_size:
+                        GazetteerPlace.objects.bulk_create(batch)
+                        rows += len(batch)
+                        batch = []
+                        self.stdout.write(f'{places} places loaded...')
+
+                GazetteerPlace.objects.bulk_create(batch)
+                rows += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Loaded {places} places ({rows} name variants) from {path}'))
+
+    def parse_line(self, line, countries, min_population):
+        if len(line) <= POPULATION or line[FEATURE_CLASS] != 'P':  # only populated places
+            return []
+        country_code = line[COUNTRY_CODE].upper()
+        if countries and country_code not in countries:
+            return []
+        try:
+            lat = float(line[LATITUDE])
+            lon = float(line[LONGITUDE])
+            population = int(line[POPULATION] or 0)
+        except ValueError:
+            return []
+        if population < min_population:
+            return []
+
+        geoname_id = int(line[GEONAME_ID]) if line[GEONAME_ID].isdigit() else None
+        max_length = GazetteerPlace._meta.get_field('normalized_name').max_length
+        names = set()
+        for name in [line[NAME], line[ASCII_NAME], *line[ALTERNATE_NAMES].split(',')]:
+            normalized = normalize_query(name)
+            if normalized and len(normalized) <= max_length:
+                names.add(normalized)
+
+        return [
+            GazetteerPlace(
+                geoname_id=geoname_id,
+                name=line[NAME][:200],
+                normalized_name=normalized,
+                country_code=country_code[:2],
+                lat=lat,
+                lon=lon,
+                population=population
+            )
+            for normalized in names
+        ]
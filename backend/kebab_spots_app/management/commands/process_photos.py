@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from kebab_spots_app.photos import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Process uploaded photos waiting in "pending" status (worker for PHOTO_PROCESSING backend "db")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running and check for new photos')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds between checks in loop mode')
+        parser.add_argument('--batch-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending(limit=options['batch_size'])
+            if processed:
+                self.stdout.write(f'{processed} photos processed')
+            if not options['loop']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from kebab_spots_app.models import REGION_LEVELS, RegionStats
+
+
+class Command(BaseCommand):
+    help = 'Calculate spots count, ratings and amenities of every heatmap grid cell again from spots'
+
+    def handle(self, *args, **options):
+        RegionStats.rebuild()
+        for level, size in enumerate(REGION_LEVELS):
+            cells = RegionStats.objects.filter(level=level).count()
+            self.stdout.write(f'Level {level} ({size} degrees): {cells} cells')
+        self.stdout.write(self.style.SUCCESS('Region stats rebuilt'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from kebab_spots_app.models import KebabSpot, KebabSpotRating
+
+
+class Command(BaseCommand):
+    help = 'Find spots whose stored rating sum/count differ from their ratings and recalculate them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only show spots with wrong ratings')
+
+    def handle(self, *args, **options):
+        totals = (
+            KebabSpotRating.objects.filter(spot=OuterRef('pk'))
+            .order_by()
+            .values('spot')
+            .annotate(total=Sum('value'), count=Count('id'))
+        )
+        drifted = (
+            KebabSpot.objects
+            .annotate(
+                real_sum=Coalesce(Subquery(totals.values('total')), Value(0)),
+                real_count=Coalesce(Subquery(totals.values('count')), Value(0)),
+            )
+            .exclude(ratings_sum=F('real_sum'), ratings_count=F('real_count'))
+            .order_by('pk')
+        )
+
+        fixed = 0
+        for spot in drifted.iterator(chunk_size=500):
+            self.stdout.write(
+                f'Spot {spot.pk}: stored {spot.ratings_sum}/{spot.ratings_count}, '
+                f'real {spot.real_sum}/{spot.real_count}'
+            )
+            if not options['dry_run']:
+                spot.update_rating()
+            fixed += 1
+
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{fixed} spots with wrong rating {action}'))
@@ -0,0 +1,114 @@
+import re
+import threading
+from collections import defaultdict
+
+
+class Counters:
+    """
+    Simple in-process counters.
+    Every worker process has its own values, so numbers are per process, not for the whole cluster.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._values[name] += amount
+
+    def get(self, name):
+        return self._values.get(name, 0)
+
+    def snapshot(self, prefix=''):
+        with self._lock:
+            return {name: value for name, value in self._values.items() if name.startswith(prefix)}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+counters = Counters()
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histograms:
+    """
+    In-process histograms in Prometheus style: number of values in every bucket, their sum and count.
+    Values are kept per (name, labels), e.g. ('request_seconds', (('view', 'spots'),)).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._buckets = {}
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            if key not in self._values:
+                self._values[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            histogram = self._values[key]
+            for i, bound in enumerate(self._buckets[name]):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """Returns (values, buckets of every histogram name)."""
+        with self._lock:
+            values = {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._values.items()}
+            return values, dict(self._buckets)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+            self._buckets.clear()
+
+
+histograms = Histograms()
+
+
+def metric_name(name, prefix='kebab_'):
+    return prefix + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+def render_prometheus():
+    """All counters and histograms of this process in Prometheus text format."""
+    lines = []
+    for name, value in sorted(counters.snapshot().items()):
+        lines.append(f'# TYPE {metric_name(name)} counter')
+        lines.append(f'{metric_name(name)} {value}')
+
+    values, buckets = histograms.snapshot()
+    for name in sorted(buckets):
+        full_name = metric_name(name)
+        lines.append(f'# TYPE {full_name} histogram')
+        for (histogram_name, labels), histogram in sorted(values.items()):
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets[name], histogram['buckets']):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{format_labels((*labels, ("le", bound)))} {cumulative}')
+            lines.append(f'{full_name}_bucket{format_labels((*labels, ("le", "+Inf")))} {histogram["count"]}')
+            lines.append(f'{full_name}_sum{format_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{full_name}_count{format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
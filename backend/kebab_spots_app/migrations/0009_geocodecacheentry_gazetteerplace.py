@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-16 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0008_kebabspot_hidden_alter_kebabspot_description_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('lat', models.FloatField(blank=True, null=True)),
+                ('lon', models.FloatField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GazetteerPlace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geoname_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('name', models.CharField(max_length=200)),
+                ('normalized_name', models.CharField(max_length=200)),
+                ('country_code', models.CharField(blank=True, max_length=2)),
+                ('lat', models.FloatField()),
+                ('lon', models.FloatField()),
+                ('population', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['normalized_name', '-population'], name='gazetteer_name_pop_idx')],
+            },
+        ),
+    ]
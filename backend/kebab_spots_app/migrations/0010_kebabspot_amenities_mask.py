@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-16 11:40
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+AMENITIES = (
+    'private_territory', 'shop_nearby', 'gazebos', 'near_water',
+    'fishing', 'trash_cans', 'tables', 'benches', 'fire_pit', 'toilet',
+    'car_access'
+)
+
+FILL_MASK = 'UPDATE kebab_spots_app_kebabspot SET amenities_mask = {}'.format(
+    ' | '.join(f'(CASE WHEN {amenity} THEN {1 << bit} ELSE 0 END)' for bit, amenity in enumerate(AMENITIES))
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0009_geocodecacheentry_gazetteerplace'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name='kebabspot',
+            name='amenities_mask',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(FILL_MASK, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='kebabspot',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['coordinates', 'amenities_mask'], name='kebabspot_coords_amenities_gist'),
+        ),
+    ]
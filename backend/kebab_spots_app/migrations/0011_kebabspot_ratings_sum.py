@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-16 12:25
+
+from django.db import migrations, models
+
+FILL_RATINGS = '''
+UPDATE kebab_spots_app_kebabspot spot
+SET ratings_sum = totals.total, ratings_count = totals.count
+FROM (
+    SELECT spot_id, SUM(value) AS total, COUNT(*) AS count
+    FROM kebab_spots_app_kebabspotrating
+    GROUP BY spot_id
+) totals
+WHERE totals.spot_id = spot.id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0010_kebabspot_amenities_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kebabspot',
+            name='ratings_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(FILL_RATINGS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-16 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0011_kebabspot_ratings_sum'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kebabspotphoto',
+            name='photo',
+            field=models.ImageField(blank=True, upload_to='kebab_spots/'),
+        ),
+        migrations.AddField(
+            model_name='kebabspotphoto',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='kebabspotphoto',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='ready', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='kebabspotphoto',
+            name='error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='kebabspotphoto',
+            name='source',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-16 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0012_kebabspotphoto_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kebabspot',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-16 15:40
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+# every existing spot gets one change, in the order they were last updated
+FILL_CHANGES = '''
+INSERT INTO kebab_spots_app_kebabspotchange (spot_id, created_at)
+SELECT id, updated_at FROM kebab_spots_app_kebabspot ORDER BY updated_at, id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0013_kebabspot_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KebabSpotChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spot_id', models.PositiveIntegerField(db_index=True)),
+                ('txid', models.BigIntegerField(db_default=django.db.models.expressions.Func(function='txid_current', output_field=models.BigIntegerField()))),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['txid', 'id'], name='spotchange_txid_id_idx')],
+            },
+        ),
+        migrations.RunSQL(FILL_CHANGES, migrations.RunSQL.noop),
+    ]
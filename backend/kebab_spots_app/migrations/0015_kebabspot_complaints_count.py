@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-16 17:05
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+FILL_COMPLAINTS = '''
+UPDATE kebab_spots_app_kebabspot spot
+SET complaints_count = totals.count
+FROM (
+    SELECT spot_id, COUNT(*) AS count
+    FROM kebab_spots_app_kebabspotcomplaint
+    GROUP BY spot_id
+) totals
+WHERE totals.spot_id = spot.id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0014_kebabspotchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kebabspot',
+            name='complaints_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(FILL_COMPLAINTS, migrations.RunSQL.noop),
+        migrations.RemoveIndex(
+            model_name='kebabspot',
+            name='kebabspot_coords_amenities_gist',
+        ),
+        migrations.AddIndex(
+            model_name='kebabspot',
+            index=django.contrib.postgres.indexes.GistIndex(condition=models.Q(('hidden', False)), fields=['coordinates', 'amenities_mask'], name='kebabspot_visible_coords_gist'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-16 17:50
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0015_kebabspot_complaints_count'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='kebabspot',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('name', config='simple', weight='A'), '||', django.contrib.postgres.search.SearchVector('description', config='simple', weight='B'), django.contrib.postgres.search.SearchConfig('simple')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='kebabspot',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('hidden', False)), fields=['search_vector'], name='kebabspot_search_vector_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='kebabspot',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(('hidden', False)), fields=['name'], name='kebabspot_name_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+    ]
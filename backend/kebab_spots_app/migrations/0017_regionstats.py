@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-16 19:10
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+# the same as RegionStats.rebuild() with the levels and amenities of this migration
+LEVELS = (4.0, 1.0, 0.25, 0.0625, 0.015625)
+AMENITIES_COUNT = 11
+AMENITY_SUMS = ', '.join(f'SUM((amenities_mask >> {bit}) & 1)' for bit in range(AMENITIES_COUNT))
+
+FILL_REGION_STATS = [f'''
+INSERT INTO kebab_spots_app_regionstats
+    (level, x, y, spots_count, rated_spots_count, ratings_count, ratings_sum, amenities_counts)
+SELECT {level}, floor(ST_X(coordinates::geometry) / {size}), floor(ST_Y(coordinates::geometry) / {size}),
+       COUNT(*), COUNT(*) FILTER (WHERE ratings_count > 0), SUM(ratings_count), SUM(ratings_sum),
+       ARRAY[{AMENITY_SUMS}]::integer[]
+FROM kebab_spots_app_kebabspot
+WHERE NOT hidden
+GROUP BY 2, 3
+''' for level, size in enumerate(LEVELS)]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0016_kebabspot_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('spots_count', models.IntegerField(default=0)),
+                ('rated_spots_count', models.IntegerField(default=0)),
+                ('ratings_count', models.IntegerField(default=0)),
+                ('ratings_sum', models.IntegerField(default=0)),
+                ('amenities_counts', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('level', 'x', 'y'), name='regionstats_cell_unique')],
+            },
+        ),
+        migrations.RunSQL(FILL_REGION_STATS, migrations.RunSQL.noop),
+    ]
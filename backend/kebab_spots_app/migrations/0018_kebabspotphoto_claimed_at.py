@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0017_regionstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kebabspotphoto',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
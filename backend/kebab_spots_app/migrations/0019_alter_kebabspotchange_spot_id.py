@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-16 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kebab_spots_app', '0018_kebabspotphoto_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='kebabspotchange',
+            name='spot_id',
+            field=models.BigIntegerField(db_index=True),
+        ),
+    ]
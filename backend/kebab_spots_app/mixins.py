@@ -1,6 +1,11 @@
 from PIL import Image
+from django.contrib.gis.db import models as gis_models
+from django.db.models import F, FloatField, Func
+from django.db.models.functions import Cast
 from rest_framework.exceptions import ValidationError
-from .models import KebabSpotPhoto
+from .models import KebabSpotPhoto, AMENITIES, amenities_to_mask
+from .photos import enqueue_photos
+from .tiles import bbox_polygon
 
 class CheckPhotosMixin:
     MAX_PHOTOS = 10
@@ -15,7 +20,7 @@ class CheckPhotosMixin:
     def validate_photos(self, photos, spot=None):
         old_photos = 0
         if spot is not None:
-            old_photos = spot.photos.count()
+            old_photos = spot.photos.exclude(status=KebabSpotPhoto.FAILED).count()
         if old_photos + len(photos) > self.MAX_PHOTOS:
             raise ValidationError({'Photos': 'Maximum photos for upload is 10'})
         for photo in photos:
@@ -29,33 +34,28 @@ class CheckPhotosMixin:
                                              f'WEBP are allowed'})
         try:
             img = Image.open(photo)
-            img.verify()  # Fast check for corrupted image
+            img.verify()  # Fast check for corrupted image, full decoding is left to the processing pipeline
             photo.seek(0)  # Going to the beginning of the file in bytes (0 - first byte)
-        except:
+        except Exception:
             raise ValidationError({'Photos': f'File {photo.name} is not a valid image or corrupted.'})
 
     def save_photos(self, spot, photos):
-        for photo in photos:
-            KebabSpotPhoto.objects.create(
-                spot=spot,
-                user=self.request.user,
-                photo=photo
-            )
+        # only saves uploaded files, processing goes in background (see photos.py)
+        enqueue_photos(spot, self.request.user, photos)
 
 
 class FiltersMixin:
-    AMENITIES = [
-        'private_territory', 'shop_nearby', 'gazebos', 'near_water',
-        'fishing', 'trash_cans', 'tables', 'benches', 'fire_pit', 'toilet',
-        'car_access'
-    ]
+    AMENITIES = AMENITIES
 
     def apply_filters(self, queryset):
         # self.request is provided by DRF views
         params = self.request.query_params
-        for amenity in self.AMENITIES:
-            if params.get(amenity):
-                queryset = queryset.filter(**{amenity: True})
+        mask = amenities_to_mask(amenity for amenity in self.AMENITIES if params.get(amenity))
+        if mask:
+            # one bitwise check instead of a filter per amenity
+            queryset = queryset.alias(
+                wanted_amenities=F('amenities_mask').bitand(mask)
+            ).filter(amenities_mask__gte=mask, wanted_amenities=mask)
 
         min_rating = params.get('min_rating')
         if min_rating:
@@ -64,3 +64,19 @@ class FiltersMixin:
             except (ValueError, TypeError):
                 pass
         return queryset
+
+    # the spatial index is used only for boxes up to this size, bigger ones cover most of the spots anyway
+    INDEXED_BBOX_DEGREES = 20
+
+    def filter_bbox(self, queryset, west, south, east, north):
+        geometry = Cast('coordinates', output_field=gis_models.PointField(srid=4326))
+        queryset = queryset.alias(
+            bbox_lon=Func(geometry, function='ST_X', output_field=FloatField()),
+            bbox_lat=Func(geometry, function='ST_Y', output_field=FloatField()),
+        ).filter(
+            bbox_lon__gte=west, bbox_lon__lte=east,
+            bbox_lat__gte=south, bbox_lat__lte=north,
+        )
+        if east - west <= self.INDEXED_BBOX_DEGREES and north - south <= self.INDEXED_BBOX_DEGREES:
+            queryset = queryset.filter(coordinates__intersects=bbox_polygon(west, south, east, north))
+        return queryset
@@ -1,8 +1,33 @@
+import math
+
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connection, models, transaction
 from django.contrib.gis.db import models as gis_models
 from config_app.settings import AUTH_USER_MODEL
-from django.db.models import Avg, Count
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models import Avg, Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Cast, Now, Round
+
+# Order matters: position in this list is the bit in KebabSpot.amenities_mask. Add new amenities only to the end.
+AMENITIES = (
+    'private_territory', 'shop_nearby', 'gazebos', 'near_water',
+    'fishing', 'trash_cans', 'tables', 'benches', 'fire_pit', 'toilet',
+    'car_access'
+)
+
+
+# text search configuration of KebabSpot.search_vector and spot text search.
+# 'simple' has no stemming, but works the same for names in any language
+SEARCH_CONFIG = 'simple'
+
+
+def amenities_to_mask(amenities):
+    mask = 0
+    for amenity in amenities:
+        mask |= 1 << AMENITIES.index(amenity)
+    return mask
 
 
 class KebabSpot(models.Model):
@@ -19,11 +44,15 @@ class KebabSpot(models.Model):
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # increased when ratings, photos or complaints of the spot change, part of the ETag (see conditional.py)
+    version = models.PositiveIntegerField(default=1, editable=False)
     hidden = models.BooleanField(default=False)
+    complaints_count = models.PositiveIntegerField(default=0, editable=False)
 
     # Rating data
     average_rating = models.DecimalField(max_digits=2, decimal_places=1, default=0.0)
     ratings_count = models.PositiveIntegerField(default=0)
+    ratings_sum = models.PositiveIntegerField(default=0)
 
     # Amenities
     private_territory = models.BooleanField(default=False)
@@ -37,20 +66,135 @@ class KebabSpot(models.Model):
     fire_pit = models.BooleanField(default=False)
     toilet = models.BooleanField(default=False)
     car_access = models.BooleanField(default=False)
+    # the same amenities as one number, bit N is AMENITIES[N]. Kept in sync in save()
+    amenities_mask = models.PositiveIntegerField(default=0, editable=False)
+
+    # Text search. Generated column, so Postgres keeps it up to date for every insert/update (raw SQL import too)
+    search_vector = models.GeneratedField(
+        expression=(SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                    + SearchVector('description', weight='B', config=SEARCH_CONFIG)),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # needs btree_gist. "mask & wanted = wanted" can't be searched in index,
+            # but it means "mask >= wanted" too, and that part is checked together with coordinates
+            # only visible spots are searched by list/search/clusters, hidden ones are not in this index at all
+            GistIndex(fields=['coordinates', 'amenities_mask'], condition=Q(hidden=False),
+                      name='kebabspot_visible_coords_gist'),
+            # full-text search by words, and typo-tolerant search by trigrams of the name (needs pg_trgm)
+            GinIndex(fields=['search_vector'], condition=Q(hidden=False), name='kebabspot_search_vector_gin'),
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], condition=Q(hidden=False),
+                     name='kebabspot_name_trgm_gin'),
+        ]
+
+    # spot is hidden automatically after this number of complaints
+    COMPLAINTS_TO_HIDE = 5
+
+    def save(self, *args, **kwargs):
+        self.amenities_mask = amenities_to_mask(amenity for amenity in AMENITIES if getattr(self, amenity))
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(AMENITIES):
+            kwargs['update_fields'] = {*update_fields, 'amenities_mask'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        spot = super().from_db(db, field_names, values)
+        # remember where the spot was loaded from, signal handlers need the old location when spot is moved
+        spot._loaded_coordinates = spot.__dict__.get('coordinates')
+        return spot
+
+    def apply_rating_change(self, delta, new_votes):
+        """
+        Changes stored rating sum and count by one vote, other ratings are not read at all.
+        delta - how the sum of ratings changes (value of new vote, or new value - old value),
+        new_votes - 1 for a new vote, 0 when user changed his vote.
+        Everything is one UPDATE with F() expressions, so concurrent votes can't overwrite each other.
+        In UPDATE, F() gives the values from before this update, so new average is calculated from them.
+        """
+        new_sum = F('ratings_sum') + delta
+        new_count = F('ratings_count') + new_votes
+        KebabSpot.objects.filter(pk=self.pk).update(
+            ratings_sum=new_sum,
+            ratings_count=new_count,
+            average_rating=Round(Cast(new_sum, models.DecimalField(max_digits=12, decimal_places=4)) / new_count, 1),
+            version=F('version') + 1,
+            updated_at=Now(),
+        )
+        self.refresh_from_db(fields=['ratings_sum', 'ratings_count', 'average_rating', 'version', 'updated_at',
+                                     'hidden'])
+        if not self.hidden:
+            # the spot itself is already counted in its region cells, only the vote is added there
+            RegionStats.add_rating(self.coordinates, delta, new_votes, first_vote=self.ratings_count == new_votes == 1)
+
+    def add_complaint(self):
+        """
+        Counts one more complaint and hides the spot when there are enough of them.
+        Counter and the hide decision are one UPDATE, so concurrent complaints are all counted
+        (Postgres applies them one after another to the newest row) and the threshold can't be missed.
+        Returns True if this complaint has hidden the spot.
+        """
+        with transaction.atomic():
+            # the row is locked until the end of the transaction, so nobody changes hidden in between
+            was_hidden = KebabSpot.objects.select_for_update().values_list('hidden', flat=True).get(pk=self.pk)
+            KebabSpot.objects.filter(pk=self.pk).update(
+                complaints_count=F('complaints_count') + 1,
+                # F() in UPDATE gives the value from before this update, so "+ 1" is compared here
+                hidden=Case(
+                    When(complaints_count__gte=self.COMPLAINTS_TO_HIDE - 1, then=Value(True)),
+                    default=F('hidden'),
+                ),
+                version=F('version') + 1,
+                updated_at=Now(),
+            )
+            self.refresh_from_db(fields=['complaints_count', 'version', 'updated_at', *REGION_STATS_FIELDS])
+            # not "count == threshold": the spot may have been unhidden by admin, or complaints deleted
+            hidden_now = self.hidden and not was_hidden
+            if hidden_now:
+                RegionStats.apply(old={**self.region_values(), 'hidden': False})
+        return hidden_now
+
+    def region_values(self):
+        """Fields of the spot that are counted in RegionStats."""
+        return {field: getattr(self, field) for field in REGION_STATS_FIELDS}
+
+    @classmethod
+    def remove_complaint(cls, pk):
+        """Complaint was deleted (by admin), the spot is not shown again automatically."""
+        cls.objects.filter(pk=pk, complaints_count__gt=0).update(
+            complaints_count=F('complaints_count') - 1,
+            version=F('version') + 1,
+            updated_at=Now(),
+        )
+
+    @classmethod
+    def bump_version(cls, pk):
+        """Marks the spot as changed when something shown with it (photos, ratings, complaints) has changed."""
+        cls.objects.filter(pk=pk).update(version=F('version') + 1, updated_at=Now())
 
     def update_rating(self):
         """
         We recalculate the average rating based on all ratings for this point.
-        This method is called every time someone adds or changes rating.
+        Votes use apply_rating_change, this is only for repairing drift (manage.py reconcile_ratings).
+        Spot row is locked, so votes that come at the same time are applied after this recalculation.
         """
-        aggregated = self.ratings.aggregate(
-            avg=Avg('value'),
-            count=Count('id')
-        )
-        # If there is no rating, avg will be None.
-        self.average_rating = aggregated['avg'] or 0.0
-        self.ratings_count = aggregated['count']
-        self.save(update_fields=['average_rating', 'ratings_count'])
+        with transaction.atomic():
+            KebabSpot.objects.select_for_update().values_list('pk', flat=True).get(pk=self.pk)
+            aggregated = self.ratings.aggregate(
+                avg=Avg('value'),
+                count=Count('id'),
+                total=Sum('value')
+            )
+            # If there is no rating, avg will be None.
+            self.average_rating = aggregated['avg'] or 0.0
+            self.ratings_count = aggregated['count']
+            self.ratings_sum = aggregated['total'] or 0
+            self.version = F('version') + 1
+            self.save(update_fields=['average_rating', 'ratings_count', 'ratings_sum', 'version', 'updated_at'])
+        self.refresh_from_db(fields=['version'])
 
     def __str__(self):
         return self.name
@@ -74,9 +218,29 @@ class KebabSpotRating(models.Model):
 
 
 class KebabSpotPhoto(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     user = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
     spot = models.ForeignKey(KebabSpot, on_delete=models.CASCADE, related_name='photos')
-    photo = models.ImageField(upload_to='kebab_spots/')
+    # empty until the photo is processed, see photos.py
+    photo = models.ImageField(upload_to='kebab_spots/', blank=True)
+    # {"320": "storage name of 320px webp", ...}
+    thumbnails = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=READY, db_index=True)
+    error = models.CharField(max_length=255, blank=True)
+    # storage name of the uploaded file, waiting for processing
+    source = models.CharField(max_length=255, blank=True)
+    # when processing was started, photos stuck in "processing" are taken again after a timeout
+    claimed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -94,3 +258,194 @@ class KebabSpotComplaint(models.Model):
 
     def __str__(self):
         return f'Complaint of {self.user.username} on {self.spot.name}'
+
+
+class GeocodeCacheEntry(models.Model):
+    """
+    Persistent cache of geocoding results, keyed by the normalized query.
+    Entries with empty coordinates mean "location not found" and are kept for a shorter time.
+    """
+    query = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255, blank=True)
+    lat = models.FloatField(null=True, blank=True)
+    lon = models.FloatField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.query
+
+
+class GazetteerPlace(models.Model):
+    """
+    Offline list of towns and villages (loaded from a GeoNames dump with `manage.py load_gazetteer`).
+    Every name variant of a place is stored as a separate row, so lookup is a single indexed query.
+    """
+    geoname_id = models.PositiveIntegerField(null=True, blank=True)
+    name = models.CharField(max_length=200)
+    normalized_name = models.CharField(max_length=200)
+    country_code = models.CharField(max_length=2, blank=True)
+    lat = models.FloatField()
+    lon = models.FloatField()
+    population = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['normalized_name', '-population'], name='gazetteer_name_pop_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.country_code})'
+
+
+class KebabSpotChange(models.Model):
+    """
+    Change log for delta sync (spots/changes/). Only the last change of every spot is kept,
+    deleted spots stay here as tombstones.
+    Changes are ordered by the id of the transaction that wrote them, not by time or by id:
+    the endpoint returns only changes of transactions that are already finished,
+    so a change committed late can't get behind the token a client already has.
+    """
+    spot_id = models.BigIntegerField(db_index=True)  # not FK, the row must stay after the spot is deleted
+    txid = models.BigIntegerField(db_default=models.Func(function='txid_current', output_field=models.BigIntegerField()))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='spotchange_txid_id_idx'),
+        ]
+
+    # ids are written in slices, an import can change more spots than one query can take parameters
+    RECORD_BATCH_SIZE = 5000
+
+    @classmethod
+    def record(cls, *spot_ids):
+        spot_ids = list(dict.fromkeys(spot_ids))
+        with transaction.atomic():
+            for start in range(0, len(spot_ids), cls.RECORD_BATCH_SIZE):
+                batch = spot_ids[start:start + cls.RECORD_BATCH_SIZE]
+                cls.objects.filter(spot_id__in=batch).delete()
+                cls.objects.bulk_create([cls(spot_id=spot_id) for spot_id in batch])
+
+    def __str__(self):
+        return f'Change of spot {self.spot_id}'
+
+
+# grid levels of RegionStats: size of the cell in degrees, from a part of a country to a part of a town.
+# Powers of two, so lon / size is exact and Python and Postgres always put a spot into the same cell
+REGION_LEVELS = (4.0, 1.0, 0.25, 0.0625, 0.015625)
+# fields of KebabSpot that RegionStats depends on
+REGION_STATS_FIELDS = ('coordinates', 'hidden', 'ratings_count', 'ratings_sum', 'amenities_mask')
+
+
+class RegionStats(models.Model):
+    """
+    Totals of visible spots in one grid cell of one level, for the heatmap (spots/heatmap/).
+    Cell is (floor(lon / size), floor(lat / size)), every visible spot is counted once on every level.
+    Totals are not recalculated from spots: saves, votes and complaints add only the difference
+    with one INSERT ... ON CONFLICT, so concurrent changes of the same cell don't overwrite each other.
+    manage.py rebuild_region_stats calculates everything again from spots.
+    """
+    level = models.PositiveSmallIntegerField()  # index in REGION_LEVELS
+    x = models.IntegerField()
+    y = models.IntegerField()
+    spots_count = models.IntegerField(default=0)
+    rated_spots_count = models.IntegerField(default=0)  # spots with at least one vote
+    ratings_count = models.IntegerField(default=0)
+    ratings_sum = models.IntegerField(default=0)
+    # number of spots with every amenity, in the order of AMENITIES
+    amenities_counts = ArrayField(models.IntegerField(), default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['level', 'x', 'y'], name='regionstats_cell_unique'),
+        ]
+
+    @property
+    def average_rating(self):
+        # average of all votes in the cell, so a spot with many votes weighs more
+        if not self.ratings_count:
+            return None
+        return round(self.ratings_sum / self.ratings_count, 1)
+
+    @staticmethod
+    def cells(point):
+        return [(level, math.floor(point.x / size), math.floor(point.y / size))
+                for level, size in enumerate(REGION_LEVELS)]
+
+    @classmethod
+    def contribution(cls, values):
+        """
+        What one spot adds to the totals: {cell: [spots, rated spots, votes, sum of votes, *amenities]}.
+        values - REGION_STATS_FIELDS of the spot, None or hidden spot adds nothing.
+        """
+        if values is None or values['hidden']:
+            return {}
+        mask = values['amenities_mask']
+        row = [1, 1 if values['ratings_count'] else 0, values['ratings_count'], values['ratings_sum'],
+               *((mask >> bit) & 1 for bit in range(len(AMENITIES)))]
+        return {cell: row for cell in cls.cells(values['coordinates'])}
+
+    @classmethod
+    def apply(cls, old=None, new=None):
+        """Moves totals from the old state of a spot to the new one (None - the spot didn't exist / is deleted)."""
+        changes = {}
+        for sign, contribution in ((-1, cls.contribution(old)), (1, cls.contribution(new))):
+            for cell, row in contribution.items():
+                total = changes.setdefault(cell, [0] * len(row))
+                for i, value in enumerate(row):
+                    total[i] += sign * value
+        cls.add(changes)
+
+    @classmethod
+    def add_rating(cls, point, delta, new_votes, first_vote):
+        row = [0, 1 if first_vote else 0, new_votes, delta, *[0] * len(AMENITIES)]
+        cls.add({cell: row for cell in cls.cells(point)})
+
+    @classmethod
+    def add(cls, changes):
+        """Adds {cell: row of differences} to the stored totals, missing cells are created."""
+        # the same order of rows in every transaction, so two of them can't lock cells in opposite order
+        rows = [(*cell, row) for cell, row in sorted(changes.items()) if any(row)]
+        if not rows:
+            return
+        values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s::integer[])'] * len(rows))
+        params = [value for level, x, y, row in rows for value in (level, x, y, *row[:4], row[4:])]
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {cls._meta.db_table} AS stats
+                    (level, x, y, spots_count, rated_spots_count, ratings_count, ratings_sum, amenities_counts)
+                VALUES {values}
+                ON CONFLICT (level, x, y) DO UPDATE SET
+                    spots_count = stats.spots_count + EXCLUDED.spots_count,
+                    rated_spots_count = stats.rated_spots_count + EXCLUDED.rated_spots_count,
+                    ratings_count = stats.ratings_count + EXCLUDED.ratings_count,
+                    ratings_sum = stats.ratings_sum + EXCLUDED.ratings_sum,
+                    -- added element by element, an amenity added later makes the arrays longer
+                    amenities_counts = ARRAY(
+                        SELECT COALESCE(a, 0) + COALESCE(b, 0)
+                        FROM unnest(stats.amenities_counts, EXCLUDED.amenities_counts) WITH ORDINALITY AS c(a, b, i)
+                        ORDER BY i
+                    )
+            ''', params)
+
+    @classmethod
+    def rebuild(cls):
+        """All totals from scratch, one GROUP BY over visible spots per level."""
+        amenities = ', '.join(f'SUM((amenities_mask >> {bit}) & 1)' for bit in range(len(AMENITIES)))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cls.objects.all().delete()
+            for level, size in enumerate(REGION_LEVELS):
+                cursor.execute(f'''
+                    INSERT INTO {cls._meta.db_table}
+                        (level, x, y, spots_count, rated_spots_count, ratings_count, ratings_sum, amenities_counts)
+                    SELECT %(level)s, floor(ST_X(coordinates::geometry) / %(size)s),
+                           floor(ST_Y(coordinates::geometry) / %(size)s),
+                           COUNT(*), COUNT(*) FILTER (WHERE ratings_count > 0), SUM(ratings_count), SUM(ratings_sum),
+                           ARRAY[{amenities}]::integer[]
+                    FROM {KebabSpot._meta.db_table}
+                    WHERE NOT hidden
+                    GROUP BY 2, 3
+                ''', {'level': level, 'size': size})
+
+    def __str__(self):
+        return f'Level {self.level} cell {self.x}:{self.y}'
@@ -0,0 +1,127 @@
+import base64
+import json
+
+from django.conf import settings
+from django.contrib.gis.measure import Distance
+from django.db.models import Q
+from django.db.models.query import EmptyQuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination without OFFSET.
+    Cursor keeps the ordering values of the last row, and the next page is
+    "rows after these values", so DB never reads and throws away previous pages.
+    The last ordering field must be unique (id), otherwise rows with equal values could be lost.
+    """
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    # None - SPOTS_PAGE_SIZE / SPOTS_MAX_PAGE_SIZE settings, read on every request (override_settings works)
+    page_size = None
+    max_page_size = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.page_queryset(queryset, request)
+        if page is None:
+            return []
+        return self.finish_page(list(page))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """The same for async views, rows are read with the async ORM."""
+        page = self.page_queryset(queryset, request)
+        if page is None:
+            return []
+        return self.finish_page([row async for row in page])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.next_position = None
+        if isinstance(queryset, EmptyQuerySet):
+            return None
+
+        self.page_size_used = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        # one extra row tells if there is a next page
+        return queryset.order_by(*self.ordering)[:self.page_size_used + 1]
+
+    def finish_page(self, rows):
+        if len(rows) > self.page_size_used:
+            rows = rows[:self.page_size_used]
+            self.next_position = [self.value(rows[-1], field) for field in self.ordering]
+        return rows
+
+    def get_page_size(self, request):
+        default = self.page_size or getattr(settings, 'SPOTS_PAGE_SIZE', 100)
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            page_size = default
+        return min(max(page_size, 1), self.get_max_page_size())
+
+    def get_max_page_size(self):
+        return self.max_page_size or getattr(settings, 'SPOTS_MAX_PAGE_SIZE', 500)
+
+    def after(self, position):
+        # (a, b) > (x, y)  ->  a > x OR (a = x AND b > y)
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            step = Q(**{f'{field}__gt': position[i]})
+            for previous, value in zip(self.ordering[:i], position):
+                step &= Q(**{previous: value})
+            condition |= step
+        return condition
+
+    def value(self, row, field):
+        value = row[field] if isinstance(row, dict) else getattr(row, field)
+        if isinstance(value, Distance):
+            return value.m
+        return value
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            if not all(isinstance(value, (int, float)) for value in position):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+        return position
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+
+
+class DistanceKeysetPagination(KeysetPagination):
+    """Nearest spots first. The view must annotate `distance`."""
+    ordering = ('distance', 'id')
+
+    def get_paginated_response(self, data):
+        # data is already FeatureCollection, next link is added next to the features
+        return Response({
+            'type': 'FeatureCollection',
+            'next': self.get_next_link(),
+            'features': data['features']
+        })
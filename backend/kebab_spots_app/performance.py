@@ -0,0 +1,184 @@
+"""
+Per-request performance instrumentation.
+PerformanceMiddleware measures sampled requests: wall time, SQL queries (count and time, through
+connection.execute_wrapper), serializer/JSON time and outbound HTTP time (code marks these parts with timed()).
+Results go to Server-Timing header and to histograms exported at /metrics in Prometheus format.
+Requests that are not sampled only pay for one random() call.
+"""
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import QUERY_BUCKETS, counters, histograms, render_prometheus
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SAMPLE_RATE': 0.01,  # part of requests that are measured, 0 turns instrumentation off
+    'SERVER_TIMING': False,  # the header shows queries and timings to every client, only for debugging
+    'QUERY_BUDGET': 20,  # queries per request, more is logged as warning
+    'LATENCY_BUDGET_MS': 500,
+    'VIEW_BUDGETS': {},  # {'spot_detail': {'QUERY_BUDGET': 3, 'LATENCY_BUDGET_MS': 100}}
+    'METRICS_TOKEN': '',  # /metrics needs "Authorization: Bearer <token>", without a token only staff can read it
+}
+PARTS = ('db', 'serialize', 'http')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PERFORMANCE', {})}
+
+
+class RequestTimings:
+    def __init__(self):
+        self.seconds = dict.fromkeys(PARTS, 0.0)
+        self.queries = 0
+        self.active = set()
+
+
+# timings of the request being handled in this thread / asyncio task
+current_timings = ContextVar('current_timings', default=None)
+
+
+@contextmanager
+def timed(part):
+    """Adds time of the block to the current request. Nested blocks of the same part are counted once."""
+    timings = current_timings.get()
+    if timings is None or part in timings.active:
+        yield
+        return
+    timings.active.add(part)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[part] += time.perf_counter() - started
+        timings.active.discard(part)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    timings = current_timings.get()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timings is not None:
+            timings.queries += 1
+            timings.seconds['db'] += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """Marks to_representation() of the serializer as "serialize" time."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class PerformanceMiddleware:
+    # works under WSGI and ASGI, so async views are not switched to a thread because of it
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = get_config()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with self.wrap_queries():
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, timings)
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            # the async ORM runs queries in a thread with a copy of this context, so they are counted too
+            with self.wrap_queries():
+                response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, time.perf_counter() - started, timings)
+
+    def is_sampled(self):
+        sample_rate = self.config['SAMPLE_RATE']
+        return bool(sample_rate) and random.random() < sample_rate
+
+    def wrap_queries(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(query_wrapper))
+        return stack
+
+    def finish(self, request, response, total, timings):
+        view = getattr(request.resolver_match, 'view_name', None) or 'unresolved'
+        self.record(view, total, timings)
+        if self.config['SERVER_TIMING']:
+            response['Server-Timing'] = self.server_timing(total, timings)
+        return response
+
+    def record(self, view, total, timings):
+        histograms.observe('request_seconds', total, view=view)
+        histograms.observe('request_queries', timings.queries, QUERY_BUCKETS, view=view)
+        for part, seconds in timings.seconds.items():
+            histograms.observe(f'request_{part}_seconds', seconds, view=view)
+
+        budgets = {**self.config, **self.config['VIEW_BUDGETS'].get(view, {})}
+        if timings.queries > budgets['QUERY_BUDGET']:
+            counters.inc(f'performance.over_query_budget.{view}')
+            logger.warning('%s made %s queries, budget is %s', view, timings.queries, budgets['QUERY_BUDGET'])
+        if total * 1000 > budgets['LATENCY_BUDGET_MS']:
+            counters.inc(f'performance.over_latency_budget.{view}')
+            logger.warning('%s took %.0f ms, budget is %s ms', view, total * 1000, budgets['LATENCY_BUDGET_MS'])
+
+    def server_timing(self, total, timings):
+        parts = [f'total;dur={total * 1000:.1f}']
+        for part in PARTS:
+            parts.append(f'{part};dur={timings.seconds[part] * 1000:.1f}')
+        parts[1] += f';desc="{timings.queries} queries"'  # db
+        return ', '.join(parts)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint with counters and histograms of this worker process."""
+    token = get_config()['METRICS_TOKEN']
+    if not token:
+        # latencies and query counts of every view are not public
+        if not request.user.is_staff:
+            raise Http404
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
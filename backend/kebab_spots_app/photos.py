@@ -0,0 +1,212 @@
+"""
+Photo processing pipeline.
+Request checks the image, saves uploaded bytes to the storage (UPLOAD_DIR) and creates KebabSpotPhoto
+with status "pending", so any worker process can read them, not only the one that took the request.
+Then a backend processes photos: checks the image, removes EXIF (GPS position of the phone and so on),
+makes WebP thumbnails and uploads everything to the storage (Cloudinary) at the same time.
+
+Backends (PHOTO_PROCESSING['BACKEND']):
+- 'sync' - processing right in the request, for tests
+- 'thread' - thread pool inside the web worker process
+- 'db' - nothing is started by the request, `manage.py process_photos --loop` takes pending photos from DB
+Photos left "pending" after a restart of the web worker are processed by `manage.py process_photos` too,
+and so are photos stuck in "processing" for longer than PROCESSING_TIMEOUT (the worker died in the middle).
+"""
+import io
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .models import KebabSpot, KebabSpotPhoto
+from .signals import spot_changed
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'thread',
+    'WORKERS': 4,
+    'UPLOAD_DIR': 'kebab_spots/uploads',  # uploaded files waiting for processing, in the default storage
+    'THUMBNAIL_SIZES': (320, 960),
+    'WEBP_QUALITY': 80,
+    'ORIGINAL_MAX_SIZE': 2560,  # px, bigger originals are scaled down
+    'PROCESSING_TIMEOUT': 10 * 60,  # seconds, after it a photo in "processing" is taken again
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PHOTO_PROCESSING', {})}
+
+
+def save_upload(upload):
+    """Saves uploaded file to UPLOAD_DIR of the storage and returns its name."""
+    name = f"{get_config()['UPLOAD_DIR']}/{uuid.uuid4().hex}{Path(upload.name).suffix.lower()}"
+    return default_storage.save(name, upload)
+
+
+def encode_webp(image, quality):
+    buffer = io.BytesIO()
+    # EXIF isn't passed to save(), so it's not written into the new file
+    image.save(buffer, format='WEBP', quality=quality)
+    return buffer.getvalue()
+
+
+def render(source, config):
+    """
+    Returns {'original': bytes, '320': bytes, ...} for uploaded bytes
+    or raises ValueError if they are not a valid image.
+    """
+    try:
+        with Image.open(io.BytesIO(source)) as image:
+            image.verify()  # fast check for corrupted image, after it the image must be opened again
+        with Image.open(io.BytesIO(source)) as image:
+            image = ImageOps.exif_transpose(image)  # rotate as the phone was held, before EXIF is dropped
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            original = image.copy()
+    except Exception as error:
+        raise ValueError('File is not a valid image or corrupted.') from error
+
+    original.thumbnail((config['ORIGINAL_MAX_SIZE'], config['ORIGINAL_MAX_SIZE']))
+    files = {'original': encode_webp(original, config['WEBP_QUALITY'])}
+    for size in config['THUMBNAIL_SIZES']:
+        thumbnail = original.copy()
+        thumbnail.thumbnail((size, size))
+        files[str(size)] = encode_webp(thumbnail, config['WEBP_QUALITY'])
+    return files
+
+
+def waiting_photos():
+    """Pending photos, and photos whose processing was started too long ago and never finished."""
+    stale = timezone.now() - timedelta(seconds=get_config()['PROCESSING_TIMEOUT'])
+    return KebabSpotPhoto.objects.filter(
+        Q(status=KebabSpotPhoto.PENDING) | Q(status=KebabSpotPhoto.PROCESSING, claimed_at__lt=stale)
+    )
+
+
+def process_photo(photo_id):
+    # only one worker can move the photo to processing, claimed_at shows when it was taken
+    claimed = waiting_photos().filter(pk=photo_id).update(status=KebabSpotPhoto.PROCESSING, claimed_at=Now())
+    if not claimed:
+        return
+    photo = KebabSpotPhoto.objects.get(pk=photo_id)
+    KebabSpot.bump_version(photo.spot_id)  # new status is visible in the spot detail
+    config = get_config()
+
+    try:
+        with default_storage.open(photo.source, 'rb') as file:
+            source = file.read()
+        files = render(source, config)
+        base_name = f'kebab_spots/{photo.spot_id}/{uuid.uuid4().hex}'
+        names = {key: f'{base_name}_{key}.webp' for key in files}
+        # uploads are network bound, so they go to the storage at the same time
+        with ThreadPoolExecutor(max_workers=len(files)) as executor:
+            saved = dict(zip(files, executor.map(
+                lambda key: default_storage.save(names[key], ContentFile(files[key])), files
+            )))
+    except Exception as error:
+        logger.warning('Photo %s processing failed: %s', photo_id, error)
+        photo.status = KebabSpotPhoto.FAILED
+        photo.error = str(error)[:255] if isinstance(error, ValueError) else 'Photo processing failed'
+        photo.save(update_fields=['status', 'error'])
+    else:
+        photo.photo.name = saved.pop('original')
+        photo.thumbnails = saved
+        photo.status = KebabSpotPhoto.READY
+        photo.error = ''
+        photo.save(update_fields=['photo', 'thumbnails', 'status', 'error'])
+        spot_changed.send(sender=KebabSpot, spot=photo.spot)
+    finally:
+        if photo.source:
+            default_storage.delete(photo.source)
+            KebabSpotPhoto.objects.filter(pk=photo_id).update(source='')
+
+
+def process_photo_in_thread(photo_id):
+    try:
+        process_photo(photo_id)
+    except Exception:
+        logger.exception('Photo %s processing failed', photo_id)
+    finally:
+        connections.close_all()  # closes only connections of this thread
+
+
+def process_pending(limit=None):
+    """Processes waiting photos from DB. Several workers can run at once, process_photo claims every photo."""
+    pending = waiting_photos().order_by('id').values_list('id', flat=True)
+    photo_ids = list(pending[:limit] if limit else pending)
+    with ThreadPoolExecutor(max_workers=get_config()['WORKERS']) as executor:
+        list(executor.map(process_photo_in_thread, photo_ids))
+    return len(photo_ids)
+
+
+class SyncBackend:
+    def enqueue(self, photo_ids):
+        for photo_id in photo_ids:
+            process_photo(photo_id)
+
+
+class ThreadBackend:
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photos')
+
+    def enqueue(self, photo_ids):
+        for photo_id in photo_ids:
+            self.executor.submit(process_photo_in_thread, photo_id)
+
+
+class DBBackend:
+    def enqueue(self, photo_ids):
+        pass  # photos are already in DB with "pending" status, worker command will take them
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = get_config()
+                backends = {
+                    'sync': SyncBackend,
+                    'thread': lambda: ThreadBackend(config['WORKERS']),
+                    'db': DBBackend,
+                }
+                _backend = backends[config['BACKEND']]()
+    return _backend
+
+
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'PHOTO_PROCESSING':
+        _backend = None
+
+
+setting_changed.connect(_reset_backend)
+
+
+def enqueue_photos(spot, user, uploads):
+    """Called by the request: saves files to the storage, creates pending photos and passes them to the backend."""
+    photos = [
+        KebabSpotPhoto.objects.create(spot=spot, user=user, status=KebabSpotPhoto.PENDING, source=save_upload(upload))
+        for upload in uploads
+    ]
+    photo_ids = [photo.id for photo in photos]
+    # workers must not see the photos before the transaction (if any) is committed
+    transaction.on_commit(lambda: get_backend().enqueue(photo_ids))
+    return photos
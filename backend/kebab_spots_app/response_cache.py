@@ -0,0 +1,136 @@
+"""
+Cache of list/search responses.
+Key is made from the rounded center, radius, filters and page, plus version numbers of the map cells
+the search circle covers. When a spot changes, versions of its cells are increased, so every cached response
+that could contain the spot gets a new key and is not used anymore (it's removed by TTL later).
+Responses of other regions are not touched.
+"""
+import hashlib
+import json
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .metrics import counters
+from .models import AMENITIES
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',  # alias from CACHES, shared cache (redis/memcached) in production
+    'TIMEOUT': 5 * 60,  # seconds
+    'CELL_DEGREES': 0.5,  # size of the invalidation cell
+    'COORD_PRECISION': 3,  # digits after the point, 3 is about 100 m
+}
+
+KM_PER_DEGREE = 111.32
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SPOT_RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE']]
+
+
+def quantize(value):
+    return round(value, get_config()['COORD_PRECISION'])
+
+
+def cell(lon, lat, size):
+    return math.floor(lon / size), math.floor(lat / size)
+
+
+def cells_in_circle(lat, lon, radius_km):
+    """Cells covered by the bounding box of the circle."""
+    size = get_config()['CELL_DEGREES']
+    lat_delta = radius_km / KM_PER_DEGREE
+    lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    west, south = cell(max(lon - lon_delta, -180), max(lat - lat_delta, -90), size)
+    east, north = cell(min(lon + lon_delta, 180), min(lat + lat_delta, 90), size)
+    return [(x, y) for x in range(west, east + 1) for y in range(south, north + 1)]
+
+
+def cell_key(x, y):
+    return f'spots:cell:{x}:{y}'
+
+
+def cell_versions(cells):
+    cache = get_cache()
+    keys = [cell_key(x, y) for x, y in cells]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # new counter starts from current time: if the old counter was evicted from cache,
+            # responses cached with its old values can't be used again
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def normalized_filters(params):
+    """The same filters written differently (order, 'true'/'1') give the same value."""
+    filters = {'amenities': sorted(amenity for amenity in AMENITIES if params.get(amenity))}
+    try:
+        filters['min_rating'] = float(params.get('min_rating'))
+    except (TypeError, ValueError):
+        pass
+    return filters
+
+
+def response_cache_key(kind, request, lat, lon, radius_km, **extra):
+    """
+    The key changes when any spot in the covered cells changes,
+    so it's used as ETag of the response too (even if caching is off).
+    """
+    params = request.query_params
+    parts = {
+        'kind': kind,
+        'host': request.get_host(),  # next links are absolute urls
+        'lat': quantize(lat),
+        'lon': quantize(lon),
+        'radius': radius_km,
+        'filters': normalized_filters(params),
+        'cursor': params.get('cursor'),
+        'page_size': params.get('page_size'),
+        'versions': cell_versions(cells_in_circle(lat, lon, radius_km)),
+        **extra,
+    }
+    digest = hashlib.md5(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return f'spots:response:{digest}'
+
+
+def get_cached_response(key):
+    if not get_config()['ENABLED']:
+        return None
+    content = get_cache().get(key)
+    counters.inc('response_cache.hits' if content is not None else 'response_cache.misses')
+    return content
+
+
+def cache_response(key, content):
+    if get_config()['ENABLED']:
+        get_cache().set(key, content, get_config()['TIMEOUT'])
+
+
+def invalidate_responses(*points):
+    """Increases versions of the cells containing the points."""
+    size = get_config()['CELL_DEGREES']
+    keys = {cell_key(*cell(point.x, point.y, size)) for point in points if point is not None}
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass  # nobody has cached responses of this cell yet
+    counters.inc('response_cache.invalidated_cells', len(keys))
+
+
+def response_cache_stats():
+    stats = counters.snapshot('response_cache.')
+    hits = stats.get('response_cache.hits', 0)
+    requests = hits + stats.get('response_cache.misses', 0)
+    stats['response_cache.hit_ratio'] = hits / requests if requests else 0
+    return stats
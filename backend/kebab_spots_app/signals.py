@@ -0,0 +1,81 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from .models import REGION_STATS_FIELDS, KebabSpot, KebabSpotChange, KebabSpotComplaint, KebabSpotPhoto, RegionStats
+from .response_cache import invalidate_responses
+from .tiles import invalidate_tiles
+
+# post_save isn't sent when spot is changed by queryset .update() (votes for example), this signal is sent instead
+spot_changed = Signal()
+
+
+def invalidate_after_commit(*points):
+    # a request between the invalidation and the commit would cache the old rows under the new version,
+    # and after a rollback there is nothing to invalidate
+    def invalidate():
+        invalidate_tiles(*points)
+        invalidate_responses(*points)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(pre_save, sender=KebabSpot)
+def spot_saving(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(REGION_STATS_FIELDS):
+        instance._stored_region_values = False  # region stats don't change
+        return
+    # stored state, not the loaded one: the instance may be older than the last votes
+    instance._stored_region_values = None if instance._state.adding else (
+        KebabSpot.objects.filter(pk=instance.pk).values(*REGION_STATS_FIELDS).first())
+
+
+@receiver(post_save, sender=KebabSpot)
+def spot_saved(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_region_values', None)
+    if stored is not False:
+        RegionStats.apply(stored, instance.region_values())
+    # created, edited, moved, hidden or re-rated: tiles and responses with the old and the new location are outdated
+    invalidate_after_commit(instance.coordinates, getattr(instance, '_loaded_coordinates', None))
+    KebabSpotChange.record(instance.pk)
+    instance._loaded_coordinates = instance.coordinates
+
+
+@receiver(post_delete, sender=KebabSpot)
+def spot_deleted(sender, instance, **kwargs):
+    RegionStats.apply(old=instance.region_values())
+    invalidate_after_commit(instance.coordinates)
+    KebabSpotChange.record(instance.pk)
+
+
+@receiver(spot_changed, sender=KebabSpot)
+def spot_updated(sender, spot, **kwargs):
+    invalidate_after_commit(spot.coordinates)
+    KebabSpotChange.record(spot.pk)
+
+
+@receiver(post_save, sender=KebabSpotPhoto)
+@receiver(post_delete, sender=KebabSpotPhoto)
+def spot_part_changed(sender, instance, **kwargs):
+    # photos belong to the spot, so ETag of the spot detail must change
+    KebabSpot.bump_version(instance.spot_id)
+
+
+@receiver(post_delete, sender=KebabSpotPhoto)
+def photo_deleted(sender, instance, **kwargs):
+    # original, thumbnails and the upload that is not processed yet are separate files in the storage,
+    # removed only after the delete is committed
+    names = [name for name in (instance.photo.name, *instance.thumbnails.values(), instance.source) if name]
+
+    def delete_files():
+        for name in names:
+            default_storage.delete(name)
+
+    transaction.on_commit(delete_files)
+
+
+@receiver(post_delete, sender=KebabSpotComplaint)
+def complaint_deleted(sender, instance, **kwargs):
+    # new complaints are counted by KebabSpot.add_complaint() in the complaint view
+    KebabSpot.remove_complaint(instance.spot_id)
@@ -0,0 +1,116 @@
+"""
+Reading and writing spot files for `manage.py import_spots` / `export_spots`.
+Files are read and written row by row, so their size doesn't matter.
+
+Formats:
+- geojson - FeatureCollection of points, properties are the spot fields
+- ndjson - one GeoJSON Feature per line
+- csv - columns id, name, lat, lon, description and amenities (1/0, true/false, yes/no)
+Exported files have the id of every spot, importing them again updates these spots.
+"""
+import csv
+import json
+from pathlib import Path
+
+from .models import AMENITIES
+
+FORMATS = ('geojson', 'ndjson', 'csv')
+CSV_COLUMNS = ('id', 'name', 'lat', 'lon', 'description', *AMENITIES)
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+READ_SIZE = 64 * 1024
+
+
+def guess_format(path):
+    suffix = Path(path).suffix.lower().lstrip('.')
+    return {'json': 'geojson', 'jsonl': 'ndjson', 'geojsonl': 'ndjson', 'geojsons': 'ndjson'}.get(suffix, suffix)
+
+
+def is_true(value):
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def spot_from_feature(feature):
+    geometry = feature.get('geometry') or {}
+    if geometry.get('type') != 'Point':
+        raise ValueError('only Point geometry is supported')
+    lon, lat = geometry['coordinates'][:2]
+    return {'id': feature.get('id'), **(feature.get('properties') or {}), 'lon': lon, 'lat': lat}
+
+
+def iter_json_array(file, key='features'):
+    """
+    Yields items of the `key` array from a big JSON object without loading the whole file.
+    Items are decoded one by one from a text buffer that keeps only the not decoded part.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = -1
+    while position < 0:  # skip everything before the array
+        chunk = file.read(READ_SIZE)
+        if not chunk:
+            raise ValueError(f'"{key}" array not found')
+        buffer += chunk
+        key_position = buffer.find(f'"{key}"')
+        if key_position >= 0:
+            position = buffer.find('[', key_position)
+    buffer = buffer[position + 1:]
+
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def read_spots(file, file_format):
+    """Yields dicts with id (may be empty), name, lat, lon, description and amenities. Values are not validated here."""
+    if file_format == 'geojson':
+        for feature in iter_json_array(file):
+            yield spot_from_feature(feature)
+    elif file_format == 'ndjson':
+        for line in file:
+            if line.strip():
+                yield spot_from_feature(json.loads(line))
+    elif file_format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        raise ValueError(f'Unknown format {file_format}, use one of {", ".join(FORMATS)}')
+
+
+def spot_feature(row):
+    return {
+        'type': 'Feature',
+        'id': row['id'],
+        'geometry': {'type': 'Point', 'coordinates': [row['lon'], row['lat']]},
+        'properties': {name: row[name] for name in CSV_COLUMNS if name not in ('id', 'lat', 'lon')},
+    }
+
+
+def write_spots(rows, file, file_format):
+    """
+    Writes rows (dicts with id and CSV_COLUMNS) one by one, returns their number.
+    CSV is not written here, export_spots gets it from PostgreSQL COPY directly.
+    """
+    count = 0
+    if file_format == 'geojson':
+        file.write('{"type":"FeatureCollection","features":[\n')
+        for count, row in enumerate(rows, 1):
+            file.write((',\n' if count > 1 else '') + json.dumps(spot_feature(row), ensure_ascii=False))
+        file.write('\n]}\n')
+    elif file_format == 'ndjson':
+        for count, row in enumerate(rows, 1):
+            file.write(json.dumps(spot_feature(row), ensure_ascii=False) + '\n')
+    else:
+        raise ValueError(f'Unknown format {file_format}')
+    return count
@@ -1,3 +1,793 @@
-from django.test import TestCase
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.contrib.gis.geos import Point
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connections
+from django.conf import settings
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_app.models import CustomUser
+from config_app.database import database_options
+from config_app.replicas import replica_lag
+from .async_views import AsyncListKebabSpotsView, AsyncSearchKebabSpotsView
+from .geocoding import get_geocoder, normalize_query
+from .metrics import counters
+from .photos import process_pending
+from .signals import spot_changed
+from .throttling import CacheWindow
+from .tiles import get_cached_tile, lonlat_to_tile
+from .serializers import KebabSpotDetailSerializer, KebabSpotListSerializer, with_details
+from .models import (KebabSpot, KebabSpotChange, KebabSpotPhoto, KebabSpotRating, GazetteerPlace, GeocodeCacheEntry,
+                     RegionStats, amenities_to_mask)
+
+FAKE_GEOCODING = {
+    'UPSTREAM': 'kebab_spots_app.geocoding.FakeGeocoder',
+    'FAKE_PLACES': {
+        'Kyiv': ('Kyiv', 50.45466, 30.5238),
+    },
+}
+
+
+class NormalizeQueryTests(TestCase):
+    def test_same_town_written_differently(self):
+        self.assertEqual(normalize_query('  KYIV,Ukraine '), 'kyiv, ukraine')
+        self.assertEqual(normalize_query('kyiv ,  ukraine'), 'kyiv, ukraine')
+
+
+@override_settings(GEOCODING=FAKE_GEOCODING)
+class GeocoderTests(TestCase):
+    def setUp(self):
+        counters.reset()
+        self.geocoder = get_geocoder()
+
+    def test_upstream_is_called_only_once(self):
+        self.assertEqual(self.geocoder.geocode('Kyiv').lat, 50.45466)
+        self.assertEqual(self.geocoder.geocode(' kyiv ').lat, 50.45466)
+        self.assertEqual(self.geocoder.upstream.calls, 1)
+        self.assertEqual(counters.get('geocoding.lru_hits'), 1)
+        self.assertTrue(GeocodeCacheEntry.objects.filter(query='kyiv').exists())
+
+    def test_db_cache_is_used_when_memory_is_empty(self):
+        self.geocoder.geocode('Kyiv')
+        self.geocoder.lru.clear()
+        self.geocoder.geocode('Kyiv')
+        self.assertEqual(self.geocoder.upstream.calls, 1)
+        self.assertEqual(counters.get('geocoding.db_cache_hits'), 1)
+
+    def test_gazetteer_before_upstream(self):
+        GazetteerPlace.objects.create(name='Lviv', normalized_name='львів', country_code='UA',
+                                      lat=49.83826, lon=24.02324, population=717273)
+        place = self.geocoder.geocode('Львів')
+        self.assertEqual(place.name, 'Lviv')
+        self.assertEqual(self.geocoder.upstream.calls, 0)
+
+    def test_not_found_is_cached(self):
+        self.assertIsNone(self.geocoder.geocode('Atlantis'))
+        self.assertIsNone(self.geocoder.geocode('Atlantis'))
+        self.assertEqual(self.geocoder.upstream.calls, 1)
+
+
+@override_settings(GEOCODING=FAKE_GEOCODING)
+class SearchKebabSpotsAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()  # caches are invalidated after commit, TestCase never commits
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        KebabSpot.objects.create(user=user, name='Near Kyiv', coordinates=Point(30.53, 50.46, srid=4326))
+
+    def test_search(self):
+        response = self.client.get(reverse('search'), {'location': 'kyiv', 'radius': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['location']['name'], 'Kyiv')
+        self.assertEqual(len(response.json()['spots']['features']), 1)
+
+    def test_unknown_location(self):
+        response = self.client.get(reverse('search'), {'location': 'Atlantis'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AmenitiesMaskTests(TestCase):
+    def test_mask_follows_boolean_fields(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        spot = KebabSpot.objects.create(user=user, name='Spot', coordinates=Point(30.5, 50.45), fishing=True)
+        self.assertEqual(spot.amenities_mask, amenities_to_mask(['fishing']))
+
+        spot.toilet = True
+        spot.save(update_fields=['toilet'])
+        spot.refresh_from_db()
+        self.assertEqual(spot.amenities_mask, amenities_to_mask(['fishing', 'toilet']))
+
+
+class ClusterKebabSpotsAPITests(APITestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        for i in range(3):
+            KebabSpot.objects.create(user=user, name=f'Spot {i}', coordinates=Point(30.5 + i * 0.001, 50.45),
+                                     fishing=i == 0)
+
+    def test_low_zoom_returns_clusters(self):
+        response = self.client.get(reverse('spot_clusters'), {'bbox': '29,50,32,51', 'zoom': 6})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['clustered'])
+        self.assertEqual([f['properties']['count'] for f in response.data['features']], [3])
+
+    def test_filters_are_applied(self):
+        response = self.client.get(reverse('spot_clusters'), {'bbox': '29,50,32,51', 'zoom': 6, 'fishing': 'true'})
+        self.assertEqual(response.data['features'][0]['properties']['count'], 1)
+
+    def test_high_zoom_returns_spots(self):
+        response = self.client.get(reverse('spot_clusters'), {'bbox': '30.4,50.4,30.6,50.5', 'zoom': 16})
+        self.assertFalse(response.data['clustered'])
+        self.assertEqual(len(response.data['features']), 3)
+
+
+class KebabSpotTileAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        self.spot = KebabSpot.objects.create(user=user, name='Spot', coordinates=Point(30.5, 50.45))
+        self.tile = (12, *lonlat_to_tile(30.5, 50.45, 12))
+
+    def test_tile_is_cached_and_invalidated(self):
+        z, x, y = self.tile
+        response = self.client.get(reverse('spot_tile', kwargs={'z': z, 'x': x, 'y': y}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertTrue(response.content)
+        self.assertIsNotNone(get_cached_tile(z, x, y))
+
+        self.spot.hidden = True
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.spot.save()
+        self.assertIsNotNone(get_cached_tile(z, x, y))  # not before the commit
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(get_cached_tile(z, x, y))
+
+
+class ListKebabSpotsAPITests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        for i in range(5):
+            KebabSpot.objects.create(user=user, name=f'Spot {i}', coordinates=Point(30.5 + i * 0.01, 50.45))
+
+    def test_pages_nearest_first(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'page_size': 2}
+        response = self.client.get(reverse('spots'), params)
+        names = [f['properties']['name'] for f in response.json()['features']]
+        self.assertEqual(names, ['Spot 0', 'Spot 1'])
+
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            names += [f['properties']['name'] for f in response.json()['features']]
+        self.assertEqual(names, [f'Spot {i}' for i in range(5)])
+
+    def test_page_size_is_limited(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'page_size': 100000}
+        response = self.client.get(reverse('spots'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['features']), 5)
+
+    @override_settings(SPOTS_MAX_PAGE_SIZE=2)
+    def test_page_size_settings_are_read_per_request(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'page_size': 100000}
+        self.assertEqual(len(self.client.get(reverse('spots'), params).json()['features']), 2)
+
+    def test_nearest(self):
+        response = self.client.get(reverse('spots'), {'lat': 50.45, 'lon': 30.532, 'nearest': 2})
+        properties = [f['properties'] for f in response.json()['features']]
+        self.assertEqual([p['name'] for p in properties], ['Spot 3', 'Spot 4'])
+        self.assertLess(properties[0]['distance'], properties[1]['distance'])
+
+    @override_settings(SPOTS_STREAM_CHUNK_SIZE=2)
+    def test_stream(self):
+        response = self.client.get(reverse('spots'), {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'stream': 1})
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(sorted(f['properties']['name'] for f in data['features']), [f'Spot {i}' for i in range(5)])
+
+    def test_same_output_as_serializer(self):
+        response = self.client.get(reverse('spots'), {'lat': 50.45, 'lon': 30.5, 'radius': 10})
+        spots = KebabSpot.objects.order_by('id')
+        expected = JSONRenderer().render(KebabSpotListSerializer(spots, many=True).data)
+        self.assertEqual(json.loads(response.content)['features'], json.loads(expected)['features'])
+
+    def test_same_bytes_as_paginated_serializer(self):
+        # what ListAPIView with serializer_class and DistanceKeysetPagination would send
+        response = self.client.get(reverse('spots'), {'lat': 50.45, 'lon': 30.5, 'radius': 10})
+        features = KebabSpotListSerializer(KebabSpot.objects.order_by('id'), many=True).data['features']
+        expected = JSONRenderer().render({'type': 'FeatureCollection', 'next': None, 'features': features})
+        self.assertEqual(response.content, expected)
+
+    def test_response_cache_is_invalidated_near_changed_spot(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10}
+        counters.reset()
+        self.client.get(reverse('spots'), params)
+        self.client.get(reverse('spots'), {**params, 'lat': 50.4500001})
+        self.assertEqual(counters.get('response_cache.hits'), 1)
+
+        # a spot far away doesn't touch this region
+        with self.captureOnCommitCallbacks(execute=True):
+            KebabSpot.objects.create(user=CustomUser.objects.get(), name='Far', coordinates=Point(24.03, 49.84))
+        self.client.get(reverse('spots'), params)
+        self.assertEqual(counters.get('response_cache.hits'), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            KebabSpot.objects.filter(name='Spot 0').update(name='Renamed')
+            spot_changed.send(sender=KebabSpot, spot=KebabSpot.objects.get(name='Renamed'))
+        response = self.client.get(reverse('spots'), params)
+        self.assertEqual(counters.get('response_cache.hits'), 2)
+        self.assertEqual(response.json()['features'][0]['properties']['name'], 'Renamed')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('spots'), {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'cursor': 'abc'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(GEOCODING=FAKE_GEOCODING)
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        for i in range(3):
+            KebabSpot.objects.create(user=user, name=f'Spot {i}', coordinates=Point(30.53 + i * 0.01, 50.46))
+
+    async def test_same_output_as_sync_views(self):
+        factory = AsyncRequestFactory()
+        for url, view, params in [
+            (reverse('spots'), AsyncListKebabSpotsView, {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'page_size': 2}),
+            (reverse('search'), AsyncSearchKebabSpotsView, {'location': 'Kyiv', 'radius': 10}),
+        ]:
+            response = await view.as_view()(factory.get(url, params))
+            cache.clear()  # sync view must build its own response, not take the cached one
+            expected = await self.async_client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected.content)
+
+    @override_settings(THROTTLING={'RATES': {'search': '1/min'}})
+    async def test_search_throttle_uses_user_from_token(self):
+        user = await CustomUser.objects.aget(username='tester')
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+        factory = AsyncRequestFactory()
+        view = AsyncSearchKebabSpotsView.as_view()
+        response = await view(factory.get('/', {'location': 'Kyiv'}, REMOTE_ADDR='10.0.0.1', **headers))
+        self.assertEqual(response.status_code, 200)
+        # another IP, but the same user
+        response = await view(factory.get('/', {'location': 'Kyiv'}, REMOTE_ADDR='10.0.0.2', **headers))
+        self.assertEqual(response.status_code, 429)
+
+    async def test_errors(self):
+        factory = AsyncRequestFactory()
+        response = await AsyncListKebabSpotsView.as_view()(factory.get('/', {'lat': 'x', 'lon': 30.5}))
+        self.assertEqual(response.status_code, 400)
+        response = await AsyncSearchKebabSpotsView.as_view()(factory.get('/', {'location': 'Atlantis'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TextSearchKebabSpotsAPITests(APITestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        KebabSpot.objects.create(user=user, name='Kebab House', coordinates=Point(30.5, 50.45))
+        KebabSpot.objects.create(user=user, name='Shawarma King', description='Grill place near the river',
+                                 coordinates=Point(30.52, 50.45))
+        KebabSpot.objects.create(user=user, name='Kebab Lviv', coordinates=Point(24.03, 49.84))
+
+    def search(self, **params):
+        response = self.client.get(reverse('spot_text_search'), params)
+        self.assertEqual(response.status_code, 200)
+        return [f['properties']['name'] for f in response.json()['features']]
+
+    def test_words_and_typos(self):
+        self.assertEqual(self.search(q='river'), ['Shawarma King'])
+        self.assertEqual(self.search(q='kebap house')[0], 'Kebab House')
+        self.assertEqual(self.search(q='kebab', lat=50.45, lon=30.5, radius=10), ['Kebab House'])
+
+    def test_hidden_spots_are_not_found(self):
+        KebabSpot.objects.filter(name='Shawarma King').update(hidden=True)
+        self.assertEqual(self.search(q='river'), [])
+
+    def test_short_query(self):
+        response = self.client.get(reverse('spot_text_search'), {'q': 'k'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RateKebabSpotAPITests(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        self.other = CustomUser.objects.create_user(username='other', password='password')
+        self.spot = KebabSpot.objects.create(user=self.user, name='Spot', coordinates=Point(30.5, 50.45))
+
+    def rate(self, user, value):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse('rate_spot', kwargs={'pk': self.spot.pk}), {'value': value})
+
+    def test_new_and_changed_votes(self):
+        self.rate(self.user, 5)
+        response = self.rate(self.other, 2)
+        self.assertEqual(response.data['average_rating'], 3.5)
+        self.assertEqual(response.data['ratings_count'], 2)
+
+        response = self.rate(self.other, 4)
+        self.assertEqual(response.data['average_rating'], 4.5)
+        self.assertEqual(response.data['ratings_count'], 2)
+        self.spot.refresh_from_db()
+        self.assertEqual(self.spot.ratings_sum, 9)
+
+    @override_settings(THROTTLING={'RATES': {'rate': '2/min'}})
+    def test_votes_are_throttled(self):
+        self.assertEqual(self.rate(self.user, 5).status_code, 200)
+        self.assertEqual(self.rate(self.user, 4).status_code, 200)
+        response = self.rate(self.user, 3)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        # other users have their own limit
+        self.assertEqual(self.rate(self.other, 3).status_code, 200)
+
+    def test_edit_keeps_votes_made_meanwhile(self):
+        spot = KebabSpot.objects.get(pk=self.spot.pk)
+        self.rate(self.other, 5)
+        serializer = KebabSpotDetailSerializer(spot, data={'name': 'Renamed', 'fishing': True}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.spot.refresh_from_db()
+        self.assertEqual((self.spot.name, self.spot.ratings_count, self.spot.ratings_sum), ('Renamed', 1, 5))
+        self.assertEqual(self.spot.amenities_mask, amenities_to_mask(['fishing']))
+
+    def test_reconcile_repairs_drift(self):
+        self.rate(self.user, 4)
+        KebabSpot.objects.filter(pk=self.spot.pk).update(ratings_sum=100, ratings_count=7)
+        call_command('reconcile_ratings', stdout=StringIO())
+        self.spot.refresh_from_db()
+        self.assertEqual((self.spot.ratings_sum, self.spot.ratings_count), (4, 1))
+
+
+class CacheWindowTests(TestCase):
+    def test_counter_expired_between_add_and_incr(self):
+        class ExpiringCache(LocMemCache):
+            # add() sees the old counter, it expires right before incr()
+            def add(self, key, value, timeout=None, version=None):
+                if not hasattr(self, 'expired'):
+                    self.expired = True
+                    return False
+                return super().add(key, value, timeout, version)
+
+        window = CacheWindow('rate', capacity=2, period=60, cache=ExpiringCache('throttle-test', {}))
+        self.assertEqual(window.take('ip:1', time.time()), 0)
+
+
+class ComplaintKebabSpotAPITests(APITestCase):
+    def setUp(self):
+        self.users = [CustomUser.objects.create_user(username=f'user{i}', password='password') for i in range(5)]
+        self.spot = KebabSpot.objects.create(user=self.users[0], name='Spot', coordinates=Point(30.5, 50.45))
+
+    def complain(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse('complaint', kwargs={'pk': self.spot.pk}), {'reason': 'no kebab'})
+
+    def test_spot_is_hidden_after_enough_complaints(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10}
+        for user in self.users[:4]:
+            self.assertEqual(self.complain(user).status_code, 201)
+        self.assertEqual(self.complain(self.users[0]).status_code, 400)
+        self.assertEqual(len(self.client.get(reverse('spots'), params).json()['features']), 1)
+
+        self.complain(self.users[4])
+        self.spot.refresh_from_db()
+        self.assertEqual((self.spot.complaints_count, self.spot.hidden), (5, True))
+        self.assertEqual(self.client.get(reverse('spots'), params).json()['features'], [])
+
+        self.spot.complaints.first().delete()
+        self.spot.refresh_from_db()
+        self.assertEqual((self.spot.complaints_count, self.spot.hidden), (4, True))
+
+    def test_hidden_state_change_is_reported_once(self):
+        for user in self.users:
+            self.complain(user)
+        more_users = [CustomUser.objects.create_user(username=f'more{i}', password='password') for i in range(2)]
+
+        # complaint deleted, a new one brings the count back: the spot was hidden all the time
+        self.spot.complaints.first().delete()
+        self.complain(more_users[0])
+        self.assertFalse(RegionStats.objects.filter(spots_count__lt=0).exists())
+
+        # admin shows the spot again, the next complaint hides it again
+        self.spot.refresh_from_db()
+        self.spot.hidden = False
+        self.spot.save()
+        self.assertTrue(RegionStats.objects.filter(spots_count=1).exists())
+        self.complain(more_users[1])
+        self.spot.refresh_from_db()
+        self.assertTrue(self.spot.hidden)
+        self.assertFalse(RegionStats.objects.exclude(spots_count=0).exists())
+
+
+class RegionStatsTests(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        self.spots = [KebabSpot.objects.create(user=self.user, name=f'Spot {i}', fishing=i == 0,
+                                               coordinates=Point(30.5 + i * 0.1, 50.45)) for i in range(3)]
+
+    def heatmap(self, **params):
+        return self.client.get(reverse('spot_heatmap'), {'bbox': '29,50,32,51', 'level': 1, **params}).json()
+
+    def cell_totals(self):
+        return sorted(RegionStats.objects.filter(spots_count__gt=0).values_list(
+            'level', 'x', 'y', 'spots_count', 'rated_spots_count', 'ratings_count', 'ratings_sum', 'amenities_counts'))
+
+    def test_heatmap_counts_spots_votes_and_amenities(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('rate_spot', kwargs={'pk': self.spots[0].pk}), {'value': 4})
+        self.client.force_authenticate(None)
+
+        properties = self.heatmap()['features'][0]['properties']
+        self.assertEqual((properties['count'], properties['rated_count'], properties['average_rating']), (3, 1, 4.0))
+        self.assertEqual(properties['amenities']['fishing'], 1)
+
+        with self.assertNumQueries(1):
+            self.heatmap(bbox='-180,-90,180,90', level=0)
+
+    def test_moved_and_hidden_spots_leave_their_cells(self):
+        spot = self.spots[0]
+        spot.coordinates = Point(35.5, 48.5)
+        spot.save()
+        features = self.heatmap(bbox='29,47,37,51', order='spots')['features']
+        self.assertEqual([f['properties']['count'] for f in features], [2, 1])
+
+        spot.hidden = True
+        spot.save(update_fields=['hidden'])
+        self.assertEqual([f['properties']['count'] for f in self.heatmap(bbox='29,47,37,51')['features']], [2])
+
+    def test_incremental_totals_equal_rebuild(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('rate_spot', kwargs={'pk': self.spots[1].pk}), {'value': 5})
+        self.client.post(reverse('rate_spot', kwargs={'pk': self.spots[1].pk}), {'value': 3})
+        self.spots[2].delete()
+        incremental = self.cell_totals()
+
+        call_command('rebuild_region_stats', stdout=StringIO())
+        self.assertEqual(self.cell_totals(), incremental)
+
+
+class DetailQueriesTests(APITestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        for i in range(3):
+            spot = KebabSpot.objects.create(user=self.user, name=f'Spot {i}', coordinates=Point(30.5, 50.45))
+            KebabSpotPhoto.objects.create(spot=spot, user=self.user, photo='kebab_spots/1.webp')
+            KebabSpotRating.objects.create(spot=spot, user=self.user, value=i + 1)
+        self.spot = spot
+
+    def test_detail_queries(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(3):  # version for the ETag, spot with user rating, photos
+            response = self.client.get(reverse('spot_detail', kwargs={'pk': self.spot.pk}))
+        self.assertEqual(response.data['properties']['user_rating'], 3)
+
+    def test_many_spots_same_queries(self):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        spots = with_details(KebabSpot.objects.order_by('id'), self.user)
+        with self.assertNumQueries(2):
+            data = KebabSpotDetailSerializer(spots, many=True, context={'request': request}).data
+        self.assertEqual([f['properties']['user_rating'] for f in data['features']], [1, 2, 3])
+        self.assertEqual([len(f['properties']['photos']) for f in data['features']], [1, 1, 1])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        self.spot = KebabSpot.objects.create(user=self.user, name='Spot', coordinates=Point(30.5, 50.45))
+        self.url = reverse('spot_detail', kwargs={'pk': self.spot.pk})
+
+    def test_detail_not_modified_until_rated(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(1):  # only version and updated_at, no photos
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse('rate_spot', kwargs={'pk': self.spot.pk}), {'value': 5})
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_not_modified(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10}
+        etag = self.client.get(reverse('spots'), params)['ETag']
+        response = self.client.get(reverse('spots'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class ChangesKebabSpotAPITests(APITransactionTestCase):
+    # changes are returned only from finished transactions, TestCase would keep the whole test in one
+
+    def test_changes_and_tombstones(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        first = KebabSpot.objects.create(user=user, name='First', coordinates=Point(30.5, 50.45))
+        second = KebabSpot.objects.create(user=user, name='Second', coordinates=Point(30.6, 50.45))
+
+        data = self.client.get(reverse('spot_changes')).json()
+        self.assertEqual([f['properties']['name'] for f in data['changed']['features']], ['First', 'Second'])
+        self.assertEqual(data['deleted'], [])
+
+        response = self.client.get(reverse('spot_changes'), {'since': data['token']})
+        self.assertEqual(response.json()['changed']['features'], [])
+
+        first.hidden = True
+        first.save()
+        second_id = second.pk
+        second.delete()
+        data = self.client.get(reverse('spot_changes'), {'since': data['token']}).json()
+        self.assertEqual(data['changed']['features'], [])
+        self.assertEqual(data['deleted'], sorted([first.pk, second_id]))
+
+
+class DatabaseOptionsTests(SimpleTestCase):
+    def test_pool_without_prepared_statements_by_default(self):
+        options = database_options({})
+        self.assertNotIn('prepare_threshold', options)
+        self.assertNotIn('server_side_binding', options)
+        self.assertEqual(options['pool']['max_size'], 10)
+
+    def test_prepared_statements_are_opt_in(self):
+        self.assertEqual(database_options({'DB_PREPARE_THRESHOLD': '5', 'DB_POOL': 'False'}),
+                         {'server_side_binding': True, 'prepare_threshold': 5})
+        self.assertEqual(database_options({'DB_PREPARE_THRESHOLD': 'none', 'DB_POOL': 'False'}), {})
+
+    def test_no_pool_without_psycopg_pool(self):
+        with mock.patch.dict(sys.modules, {'psycopg_pool': None}):  # import of psycopg_pool fails
+            self.assertNotIn('pool', database_options({'DB_POOL': 'False'}))
+            with self.assertRaises(ImportError):
+                database_options({'DB_POOL': 'True'})
+
+    def test_settings_are_loaded_without_psycopg_pool(self):
+        code = ("import sys; sys.modules['psycopg_pool'] = None; from config_app import settings; "
+                "database = settings.DATABASES['default']; options = database['OPTIONS']; "
+                "print('pool' in options, options['prepare_threshold'], database['CONN_MAX_AGE'])")
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                                env={**os.environ, 'DB_POOL': 'False', 'DB_PREPARE_THRESHOLD': '5'})
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ['False', '5', '600'])
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica1'], 'LAG_CHECK_SECONDS': 60})
+class ReplicaRoutingTests(APITransactionTestCase):
+    # replica1 is a mirror of the test database with its own connection, so data must be committed
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        self.spot = KebabSpot.objects.create(user=self.user, name='Spot', coordinates=Point(30.5, 50.45))
+
+    def queries(self, alias, method, url, data=None):
+        with CaptureQueriesContext(connections[alias]) as captured:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400)
+        return len(captured)
+
+    def test_reads_go_to_replica(self):
+        self.assertGreater(self.queries('replica1', 'get', reverse('spot_detail', kwargs={'pk': self.spot.pk})), 0)
+
+    def test_client_reads_primary_after_write(self):
+        self.client.force_authenticate(self.user)
+        self.queries('default', 'post', reverse('rate_spot', kwargs={'pk': self.spot.pk}), {'value': 5})
+        self.assertEqual(self.queries('replica1', 'get', reverse('spot_detail', kwargs={'pk': self.spot.pk})), 0)
+
+    def test_streamed_list_reads_replica(self):
+        params = {'lat': 50.45, 'lon': 30.5, 'radius': 10, 'stream': 1}
+        with CaptureQueriesContext(connections['replica1']) as captured:
+            response = self.client.get(reverse('spots'), params)
+            content = b''.join(response.streaming_content)  # rows are read while the response is sent
+        self.assertEqual(len(json.loads(content)['features']), 1)
+        self.assertTrue(any(KebabSpot._meta.db_table in query['sql'] for query in captured.captured_queries))
+
+    def test_lagging_replica_is_not_used(self):
+        replica_lag.lag['replica1'] = (10.0, time.monotonic())
+        self.assertEqual(self.queries('replica1', 'get', reverse('spot_detail', kwargs={'pk': self.spot.pk})), 0)
+
+
+class ImportExportSpotsTests(TestCase):
+    def test_import_merges_duplicates_and_export(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        lake = KebabSpot.objects.create(user=user, name='Lake', coordinates=Point(30.5, 50.45))
+        features = [
+            {'name': 'lake', 'fishing': True, 'coordinates': [30.5001, 50.45]},  # ~7 m from the existing one
+            {'name': 'New', 'coordinates': [31.0, 50.0]},
+            {'name': 'New', 'coordinates': [31.0001, 50.0]},  # duplicate inside the file
+            {'name': '', 'coordinates': [31.0, 50.0]},  # invalid
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/spots.ndjson'
+            with open(path, 'w') as file:
+                for feature in features:
+                    coordinates = feature.pop('coordinates')
+                    file.write(json.dumps({'type': 'Feature', 'properties': feature,
+                                           'geometry': {'type': 'Point', 'coordinates': coordinates}}) + '\n')
+            call_command('import_spots', path, user='tester', stdout=StringIO())
+
+            lake.refresh_from_db()
+            self.assertTrue(lake.fishing)
+            self.assertEqual(lake.amenities_mask, amenities_to_mask(['fishing']))
+            self.assertEqual(KebabSpot.objects.filter(name='New').count(), 1)
+
+            export_path = f'{directory}/export.ndjson'
+            call_command('export_spots', export_path, stderr=StringIO())
+            with open(export_path) as file:
+                names = [json.loads(line)['properties']['name'] for line in file]
+        self.assertEqual(names, ['Lake', 'New'])
+
+    def test_exported_file_is_imported_as_update(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        # far from each other and renamed in the file, so only the id can match them
+        spot = KebabSpot.objects.create(user=user, name='Lake', coordinates=Point(30.5, 50.45))
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/export.ndjson'
+            call_command('export_spots', path, stderr=StringIO())
+            with open(path) as file:
+                feature = json.loads(file.readline())
+            self.assertEqual(feature['id'], spot.pk)
+            feature['properties'].update(name='Lake renamed', toilet=True)
+            with open(path, 'w') as file:
+                file.write(json.dumps(feature) + '\n')
+            call_command('import_spots', path, user='tester', stdout=StringIO())
+
+        self.assertEqual(KebabSpot.objects.count(), 1)
+        spot.refresh_from_db()
+        self.assertTrue(spot.toilet)
+
+    @mock.patch.object(KebabSpotChange, 'RECORD_BATCH_SIZE', 2)
+    def test_changes_of_large_import_are_recorded_in_batches(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        spot = KebabSpot.objects.create(user=user, name='Lake', coordinates=Point(30.5, 50.45))
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/spots.ndjson'
+            with open(path, 'w') as file:
+                file.write(json.dumps({'type': 'Feature', 'id': spot.pk, 'properties': {'name': 'Lake', 'toilet': True},
+                                       'geometry': {'type': 'Point', 'coordinates': [30.5, 50.45]}}) + '\n')
+                for i in range(4):
+                    file.write(json.dumps({'type': 'Feature', 'properties': {'name': f'New {i}'},
+                                           'geometry': {'type': 'Point', 'coordinates': [31.0 + i, 50.0]}}) + '\n')
+            call_command('import_spots', path, user='tester', stdout=StringIO())
+
+        spot_ids = sorted(KebabSpot.objects.values_list('id', flat=True))
+        self.assertEqual(len(spot_ids), 5)
+        self.assertEqual(sorted(KebabSpotChange.objects.values_list('spot_id', flat=True)), spot_ids)
+
+
+class PerformanceMiddlewareTests(APITestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='tester', password='password')
+        self.spot = KebabSpot.objects.create(user=user, name='Spot', coordinates=Point(30.5, 50.45))
+
+    @override_settings(PERFORMANCE={'SAMPLE_RATE': 1.0, 'SERVER_TIMING': True, 'METRICS_TOKEN': 'secret'})
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(reverse('spot_detail', kwargs={'pk': self.spot.pk}))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        metrics = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('kebab_request_seconds_count{view="spot_detail"}', metrics)
+
+    def test_metrics_are_not_public_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        staff = CustomUser.objects.create_user(username='admin', password='password', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(PERFORMANCE={'SAMPLE_RATE': 1.0})
+    def test_server_timing_is_not_public_by_default(self):
+        response = self.client.get(reverse('spot_detail', kwargs={'pk': self.spot.pk}))
+        self.assertNotIn('Server-Timing', response)
+
+
+def image_upload(name='photo.jpg', size=(1200, 800)):
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'
+    Image.new('RGB', size, 'red').save(buffer, format='JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class PhotoProcessingTests(APITestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            MEDIA_ROOT=self.media.name,
+            PHOTO_PROCESSING={'BACKEND': 'sync'},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = CustomUser.objects.create_user(username='tester', password='password')
+        self.client.force_authenticate(self.user)
+
+    def create_spot(self, photos):
+        data = {'name': 'Spot', 'coordinates': '{"type": "Point", "coordinates": [30.5, 50.45]}', 'photos': photos}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('create_spot'), data, format='multipart')
+
+    def test_photos_get_thumbnails_without_exif(self):
+        response = self.create_spot([image_upload(), image_upload()])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([p['status'] for p in response.data['properties']['photos']], ['pending', 'pending'])
+
+        for photo in KebabSpotPhoto.objects.all():
+            self.assertEqual(photo.status, KebabSpotPhoto.READY)
+            self.assertEqual(set(photo.thumbnails), {'320', '960'})
+            with photo.photo.open() as file, Image.open(file) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertFalse(image.getexif())
+
+    def test_broken_photo_is_rejected(self):
+        broken = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        response = self.create_spot([broken])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(KebabSpotPhoto.objects.exists())
+
+    def test_photo_that_cannot_be_decoded_fails(self):
+        with override_settings(PHOTO_PROCESSING={'BACKEND': 'db'}):
+            self.create_spot([image_upload()])
+        photo = KebabSpotPhoto.objects.get()
+        # header is fine, the image data is cut off
+        with default_storage.open(photo.source, 'rb') as file:
+            content = file.read()
+        default_storage.delete(photo.source)
+        default_storage.save(photo.source, ContentFile(content[:len(content) // 2]))
+        process_pending()
+        self.assertFalse(default_storage.exists(photo.source))
+        photo.refresh_from_db()
+        self.assertEqual(photo.status, KebabSpotPhoto.FAILED)
+        self.assertTrue(photo.error)
+
+    def test_stuck_photo_is_processed_again(self):
+        with override_settings(PHOTO_PROCESSING={'BACKEND': 'db'}):
+            self.create_spot([image_upload()])
+        # the worker took the photo an hour ago and died
+        KebabSpotPhoto.objects.update(status=KebabSpotPhoto.PROCESSING,
+                                      claimed_at=timezone.now() - timedelta(hours=1))
+        source = KebabSpotPhoto.objects.get().source
+        self.assertTrue(default_storage.exists(source))  # any worker process can read it
+        self.assertEqual(process_pending(), 1)
+        self.assertEqual(KebabSpotPhoto.objects.get().status, KebabSpotPhoto.READY)
+        self.assertFalse(default_storage.exists(source))
+
+    def test_files_are_deleted_with_photo(self):
+        self.create_spot([image_upload()])
+        photo = KebabSpotPhoto.objects.get()
+        names = [photo.photo.name, *photo.thumbnails.values()]
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('delete_photo', kwargs={'pk': photo.pk}))
+        self.assertFalse(any(default_storage.exists(name) for name in names))
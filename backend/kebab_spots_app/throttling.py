@@ -0,0 +1,191 @@
+"""
+Rate limits of expensive endpoints (votes, complaints, new spots, search that may call Nominatim).
+Every user (or IP for anonymous requests) has a token bucket per scope: a request takes one token,
+tokens come back at the configured rate, so short bursts up to the full limit are allowed.
+
+'local' backend keeps buckets in the memory of the worker, no locks and no network on this path.
+'cache' backend makes the limit common for all workers through a shared cache (redis/memcached):
+the local bucket is checked first (it's never stricter than the shared limit), then a sliding window
+counter in the cache. Django cache has atomic incr() but no compare-and-set, so the shared part is
+a counter, not a bucket.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import counters
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'local',  # 'local' or 'cache'
+    'CACHE': 'default',  # alias from CACHES for the 'cache' backend
+    'RATES': {},  # {'scope': '30/min'}, views choose the scope with throttle_scope
+    'MAX_KEYS': 100000,  # local buckets, idle ones are removed when there are more
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+def parse_rate(rate):
+    """'30/min' -> (30, 60.0): number of requests and period in seconds."""
+    number, period = rate.split('/')
+    return int(number), float(PERIODS[period[0]])
+
+
+class LocalBuckets:
+    """
+    Token buckets of one scope in a dict: key -> (tokens, time of the last update).
+    No lock: two requests of the same key at the same moment may both take the same token,
+    so a limit can be passed by a request or two, but nobody waits for a lock.
+    """
+
+    def __init__(self, capacity, period, max_keys):
+        self.capacity = capacity
+        self.refill = capacity / period  # tokens per second
+        self.max_keys = max_keys
+        self.buckets = {}
+        self._cleanup_lock = threading.Lock()
+
+    def take(self, key, now):
+        """Returns 0 if the request is allowed, otherwise seconds until the next token."""
+        tokens, updated = self.buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.refill)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / self.refill
+        if key not in self.buckets and len(self.buckets) >= self.max_keys:
+            self.remove_full(now)
+        self.buckets[key] = (tokens - 1, now)
+        return 0
+
+    def remove_full(self, now):
+        # a full bucket is the same as no bucket, so idle keys can be dropped
+        if not self._cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            for key, (tokens, updated) in list(self.buckets.items()):
+                if tokens + (now - updated) * self.refill >= self.capacity:
+                    self.buckets.pop(key, None)
+        finally:
+            self._cleanup_lock.release()
+
+
+class CacheWindow:
+    """
+    Shared limit: requests are counted in fixed windows with cache.incr(), and the count of the
+    previous window is added in proportion to how much of it is still inside the sliding window.
+    """
+
+    def __init__(self, scope, capacity, period, cache):
+        self.scope = scope
+        self.capacity = capacity
+        self.period = period
+        self.cache = cache
+
+    def take(self, key, now):
+        window = int(now // self.period)
+        current_key = f'throttle:{self.scope}:{key}:{window}'
+        # add() sets the counter with a timeout only if it doesn't exist, incr() keeps the timeout
+        timeout = int(self.period * 2) + 1
+        if self.cache.add(current_key, 1, timeout=timeout):
+            current = 1
+        else:
+            try:
+                current = self.cache.incr(current_key)
+            except ValueError:
+                # the counter expired (or was evicted) between add() and incr()
+                self.cache.add(current_key, 1, timeout=timeout)
+                current = 1
+        previous = self.cache.get(f'throttle:{self.scope}:{key}:{window - 1}', 0)
+        elapsed = now / self.period - window  # part of the current window that has passed
+        count = current + previous * (1 - elapsed)
+        if count <= self.capacity:
+            return 0
+        if current > self.capacity:
+            # even without the previous window: wait for the next one
+            return (window + 1) * self.period - now
+        # the previous window leaves the sliding window gradually
+        return min((count - self.capacity) / previous * self.period, (window + 1) * self.period - now)
+
+
+class Limiter:
+    def __init__(self, config=None):
+        config = config or get_config()
+        self.enabled = config['ENABLED']
+        self.local = {}
+        self.shared = {}
+        for scope, rate in config['RATES'].items():
+            capacity, period = parse_rate(rate)
+            self.local[scope] = LocalBuckets(capacity, period, config['MAX_KEYS'])
+            if config['BACKEND'] == 'cache':
+                self.shared[scope] = CacheWindow(scope, capacity, period, caches[config['CACHE']])
+
+    def take(self, scope, key):
+        """Returns 0 if the request is allowed, otherwise seconds to wait. Unknown scopes are not limited."""
+        buckets = self.local.get(scope)
+        if not self.enabled or buckets is None:
+            return 0
+        now = time.time()
+        wait = buckets.take(key, now)
+        if not wait and scope in self.shared:
+            wait = self.shared[scope].take(key, now)
+        return wait
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = Limiter()
+    return _limiter
+
+
+def _reset_limiter(setting, **kwargs):
+    # override_settings(THROTTLING=...) in tests must build new buckets
+    global _limiter
+    if setting in ('THROTTLING', 'CACHES'):
+        _limiter = None
+
+
+setting_changed.connect(_reset_limiter)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    DRF throttle for views with `throttle_scope`. DRF answers 429 with Retry-After when it fails.
+    Authenticated users are limited by id, anonymous requests by IP (see NUM_PROXIES of DRF).
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is None:
+            return True
+        user = request.user
+        key = f'user:{user.pk}' if user and user.is_authenticated else f'ip:{self.get_ident(request)}'
+        self.wait_seconds = get_limiter().take(scope, key)
+        if self.wait_seconds:
+            counters.inc(f'throttling.denied.{scope}')
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def retry_after(wait):
+    # whole seconds, at least 1
+    return str(max(math.ceil(wait), 1))
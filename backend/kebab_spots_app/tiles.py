@@ -0,0 +1,94 @@
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+
+# Web Mercator can't show poles, tiles end at this latitude
+MAX_LATITUDE = 85.0511287798066
+MAX_ZOOM = 22
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns (west, south, east, north) in degrees for XYZ tile, the same scheme Leaflet/OSM tiles use.
+    Tile y=0 is at the north.
+    """
+    n = 2 ** z
+    west = x / n * 360 - 180
+    east = (x + 1) / n * 360 - 180
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def lonlat_to_tile(lon, lat, z):
+    """Returns (x, y) of the tile containing the point at zoom z."""
+    n = 2 ** z
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def parse_bbox(value):
+    """
+    'min_lon,min_lat,max_lon,max_lat' -> tuple of floats.
+    Raises ValueError if bbox is malformed.
+    """
+    west, south, east, north = (float(part) for part in value.split(','))
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError('Invalid bbox')
+    return west, south, east, north
+
+
+def bbox_polygon(west, south, east, north, step=1.0, margin=0.05):
+    """
+    Geography edges are great circles, not lines of constant latitude,
+    so a plain 4-point box bends towards the pole and misses points near its southern edge.
+    Extra vertices every `step` degrees keep the polygon close to the real box,
+    and the small margin covers what is left. Exact check is done separately.
+    """
+    west, east = max(west - margin, -180), min(east + margin, 180)
+    south, north = max(south - margin, -90), min(north + margin, 90)
+
+    def steps(start, end):
+        count = max(int(math.ceil(abs(end - start) / step)), 1)
+        return [start + (end - start) * i / count for i in range(count)]
+
+    ring = (
+        [(lon, south) for lon in steps(west, east)]
+        + [(east, lat) for lat in steps(south, north)]
+        + [(lon, north) for lon in steps(east, west)]
+        + [(west, lat) for lat in steps(north, south)]
+    )
+    ring.append(ring[0])
+    return Polygon(ring, srid=4326)
+
+
+def tile_cache_key(z, x, y):
+    return f'mvt:{z}:{x}:{y}'
+
+
+def get_cached_tile(z, x, y):
+    return cache.get(tile_cache_key(z, x, y))
+
+
+def cache_tile(z, x, y, tile):
+    cache.set(tile_cache_key(z, x, y), tile, getattr(settings, 'SPOT_TILE_CACHE_TIMEOUT', 24 * 60 * 60))
+
+
+def invalidate_tiles(*points):
+    """Drops cached tiles of every zoom level that contain one of the points."""
+    keys = set()
+    for point in points:
+        if point is None:
+            continue
+        for z in range(MAX_ZOOM + 1):
+            keys.add(tile_cache_key(z, *lonlat_to_tile(point.x, point.y, z)))
+    if keys:
+        cache.delete_many(list(keys))
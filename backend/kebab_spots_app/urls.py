@@ -1,11 +1,29 @@
+from django.conf import settings
 from django.urls import path
+from .async_views import AsyncListKebabSpotsView, AsyncSearchKebabSpotsView
 from .views import (ListKebabSpotsAPIView, CreateKebabSpotAPIView, DetailsKebabSpotAPIView, UpdateKebabSpotAPIView,
                     SearchKebabSpotsAPIView, RateKebabSpotAPIView, DeleteKebabSpotPhotoAPIView,
-                    ComplaintKebabSpotAPIView)
+                    ComplaintKebabSpotAPIView, GeocodingStatsAPIView, ClusterKebabSpotsAPIView,
+                    KebabSpotTileAPIView, ResponseCacheStatsAPIView, ChangesKebabSpotAPIView,
+                    TextSearchKebabSpotsAPIView, HeatmapKebabSpotsAPIView)
+
+# under ASGI list and search don't hold a thread while they wait for DB or Nominatim
+if settings.ASYNC_VIEWS:
+    list_view, search_view = AsyncListKebabSpotsView.as_view(), AsyncSearchKebabSpotsView.as_view()
+else:
+    list_view, search_view = ListKebabSpotsAPIView.as_view(), SearchKebabSpotsAPIView.as_view()
 
 urlpatterns = [
-    path('spots/', ListKebabSpotsAPIView.as_view(), name='spots'),
-    path('search/', SearchKebabSpotsAPIView.as_view(), name='search'),
+    path('spots/', list_view, name='spots'),
+    path('spots/text_search/', TextSearchKebabSpotsAPIView.as_view(), name='spot_text_search'),
+    path('spots/changes/', ChangesKebabSpotAPIView.as_view(), name='spot_changes'),
+    path('spots/cache/stats/', ResponseCacheStatsAPIView.as_view(), name='response_cache_stats'),
+    path('spots/clusters/', ClusterKebabSpotsAPIView.as_view(), name='spot_clusters'),
+    path('spots/clusters/<int:z>/<int:x>/<int:y>/', ClusterKebabSpotsAPIView.as_view(), name='spot_clusters_tile'),
+    path('spots/heatmap/', HeatmapKebabSpotsAPIView.as_view(), name='spot_heatmap'),
+    path('spots/tiles/<int:z>/<int:x>/<int:y>.mvt', KebabSpotTileAPIView.as_view(), name='spot_tile'),
+    path('search/', search_view, name='search'),
+    path('search/stats/', GeocodingStatsAPIView.as_view(), name='geocoding_stats'),
     path('create_spot/', CreateKebabSpotAPIView.as_view(), name='create_spot'),
     path('spot_detail/<int:pk>/', DetailsKebabSpotAPIView.as_view(), name='spot_detail'),
     path('spot_update/<int:pk>/', UpdateKebabSpotAPIView.as_view(), name='spot_update'),
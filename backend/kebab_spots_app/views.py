@@ -1,16 +1,48 @@
+import math
+
 import requests
 from rest_framework import generics, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from django.conf import settings
+from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
-
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, router, transaction
+from django.db.models import Avg, Count, F, FloatField, Func, Min, Q
+from django.db.models.functions import Cast, Floor, Greatest
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
+
+from auth_app.authentication import StatelessJWTAuthentication
+
+from .conditional import not_modified, set_validators, spot_etag
+from .expressions import KNNDistance
+from .geocoding import get_geocoder, geocoding_stats
+from .geojson import (LIST_PROPERTIES, dumps, feature_collection, geojson_response, geojson_streaming_response,
+                      spot_rows)
 from .mixins import CheckPhotosMixin, FiltersMixin
-from .models import KebabSpot, KebabSpotRating, KebabSpotPhoto, KebabSpotComplaint
-from .serializers import KebabSpotListSerializer, KebabSpotDetailSerializer, KebabSpotComplaintSerializer
+from .pagination import DistanceKeysetPagination
+from .models import (AMENITIES, REGION_LEVELS, SEARCH_CONFIG, KebabSpot, KebabSpotChange, KebabSpotRating,
+                     KebabSpotPhoto, KebabSpotComplaint, RegionStats)
+from .response_cache import (cache_response, get_cached_response, quantize, response_cache_key,
+                             response_cache_stats)
+from .signals import spot_changed
+from .serializers import (KebabSpotListSerializer, KebabSpotDetailSerializer, KebabSpotComplaintSerializer,
+                          with_details)
+from .tiles import MAX_ZOOM, cache_tile, get_cached_tile, is_valid_tile, parse_bbox, tile_bounds
+
+
+NEAREST_PROPERTIES = LIST_PROPERTIES + ('distance',)
+# read-only views need only the id of the user (or nothing), so the user is built from the token without a query
+READ_ONLY_AUTHENTICATION = [StatelessJWTAuthentication]
 
 
 class ListKebabSpotsAPIView(FiltersMixin, generics.ListAPIView):
@@ -19,9 +51,59 @@ class ListKebabSpotsAPIView(FiltersMixin, generics.ListAPIView):
     If data in query_params is not valid we return basic queryset,
     and load all spots in standard radius which indicated in frontend.
     If coordinates are not given at all, we don't load ALL spots from DB.
+    Spots are returned nearest first, page by page (?cursor=...&page_size=...).
+    With ?nearest=N radius is not needed, N closest spots are returned with their distance in meters.
+    With ?stream=1 all spots in radius (up to SPOTS_STREAM_MAX_SPOTS) are streamed as one FeatureCollection.
     """
+    authentication_classes = READ_ONLY_AUTHENTICATION
     serializer_class = KebabSpotListSerializer
-    queryset = KebabSpot.objects.all()
+    pagination_class = DistanceKeysetPagination
+    queryset = KebabSpot.objects.filter(hidden=False)
+
+    def is_nearest_mode(self):
+        return self.request.query_params.get('nearest') is not None
+
+    def is_stream_mode(self):
+        return self.request.query_params.get('stream') in ('1', 'true')
+
+    def list(self, request, *args, **kwargs):
+        # the same output as serializer_class gives, but built by the fast path from geojson.py
+        queryset = self.get_queryset()
+        if queryset.query.is_empty():
+            return geojson_response(feature_collection([], next=None))
+
+        rows = spot_rows(queryset, 'distance')
+        if self.is_nearest_mode():
+            return geojson_response(feature_collection(rows[:self.nearest], properties=NEAREST_PROPERTIES))
+
+        if self.is_stream_mode():
+            return self.stream(queryset)
+
+        # the same map view (rounded center, radius, filters, page) is taken from the response cache
+        lat, lon = self.center
+        cache_key = response_cache_key('spots', self.request, lat, lon, self.radius)
+        # cache key changes with every spot change in the region, so it's the ETag too
+        etag = quote_etag(cache_key)
+        response = not_modified(request, etag)
+        if response is None:
+            content = get_cached_response(cache_key)
+            if content is None:
+                page = self.paginate_queryset(rows)
+                content = dumps(feature_collection(page, next=self.paginator.get_next_link()))
+                cache_response(cache_key, content)
+            response = geojson_response(content)
+        return set_validators(response, etag)
+
+    def stream(self, queryset):
+        # without ORDER BY Postgres sends first rows before it has found all of them,
+        # so the first bytes don't wait for the whole result (spots are not sorted by distance here)
+        max_spots = getattr(settings, 'SPOTS_STREAM_MAX_SPOTS', 100000)
+        rows = spot_rows(queryset.order_by())[:max_spots]
+        # rows are read after the view returns, when ReplicaMiddleware has left the read-only scope,
+        # so the database (a replica for GET) is chosen now
+        rows = rows.using(rows.db)
+        is_async = isinstance(self.request._request, ASGIRequest)
+        return geojson_streaming_response(rows, is_async=is_async)
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -33,6 +115,9 @@ class ListKebabSpotsAPIView(FiltersMixin, generics.ListAPIView):
         if lat is None or lon is None:
             return KebabSpot.objects.none()
 
+        if self.is_nearest_mode():
+            return self.get_nearest_queryset(qs, lat, lon)
+
         try:
             lat = float(lat)
             lon = float(lon)
@@ -42,18 +127,39 @@ class ListKebabSpotsAPIView(FiltersMixin, generics.ListAPIView):
         except (ValueError, TypeError):
             raise ValidationError({'details:' 'lat/lon/radius must be numbers'})
 
-        center_point = Point(lon, lat, srid=4326)
+        # rounded to ~100 m, so all requests with one cache key get the same spots
+        self.center = (quantize(lat), quantize(lon))
+        self.radius = radius
+        center_point = Point(self.center[1], self.center[0], srid=4326)
         qs = qs.filter(coordinates__distance_lte=(center_point, D(km=float(radius))))
+        qs = qs.annotate(distance=Distance('coordinates', center_point))
         qs = self.apply_filters(qs)
         return qs
 
+    def get_nearest_queryset(self, qs, lat, lon):
+        max_nearest = DistanceKeysetPagination().get_max_page_size()
+        try:
+            center_point = Point(float(lon), float(lat), srid=4326)
+            nearest = int(self.request.query_params.get('nearest'))
+        except (ValueError, TypeError):
+            raise ValidationError({'details': 'lat/lon must be numbers and nearest must be integer'})
+        if nearest < 1 or nearest > max_nearest:
+            raise ValidationError({'details': f'nearest must be between 1 and {max_nearest}'})
+
+        # no radius: KNN index scan stops as soon as N spots are found (list() takes only N rows)
+        self.nearest = nearest
+        qs = self.apply_filters(qs)
+        qs = qs.annotate(distance=KNNDistance('coordinates', center_point))
+        return qs.order_by('distance', 'id')
+
 
 class SearchKebabSpotsAPIView(FiltersMixin, APIView):
     """
     Getting name of city/village and radius from frontend.
-    Making search request to openstreetmap.
-
+    Location is resolved by the Geocoder (caches -> gazetteer -> openstreetmap).
     """
+    authentication_classes = READ_ONLY_AUTHENTICATION
+    throttle_scope = 'search'
 
     def get(self, request):
         location_name = self.request.query_params.get('location')
@@ -65,27 +171,11 @@ class SearchKebabSpotsAPIView(FiltersMixin, APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        nominatim_url = 'https://nominatim.openstreetmap.org/search'
-        params = {
-            'q': location_name,
-            'format': 'json',
-            'limit': 1
-        }
-
-        headers = {'User-Agent': 'KebabSpots/2.0 (ktm2142@gmail.com)'}
-
         try:
-            response = requests.get(nominatim_url, params=params, headers=headers)
-            response.raise_for_status()
-
-            data = response.json()
-            """
-            .json() - belongs to the requests library
-            .json() takes response.text, which looks like a string,
-            and parses it into a Python object (list or dictionary)
-            """
+            # memory/DB caches and offline gazetteer first, Nominatim only if nothing was found there
+            place = get_geocoder().geocode(location_name)
 
-            if not data:
+            if place is None:
                 return Response(
                     {'error': 'Location not found'},
                     status=status.HTTP_404_NOT_FOUND
@@ -97,27 +187,41 @@ class SearchKebabSpotsAPIView(FiltersMixin, APIView):
             content - bytes (if it is a file or image).
             """
 
-            lat = float(data[0]['lat'])
-            lon = float(data[0]['lon'])
+            lat = place.lat
+            lon = place.lon
             center_point = Point(lon, lat, srid=4326)
 
-            # getting points based on coordinates given from Nominatim
+            # getting points based on coordinates given from the geocoder
             nearby_spots = KebabSpot.objects.filter(
+                hidden=False,
                 coordinates__distance_lte=(center_point, D(km=float(radius)))
-            )
+            ).annotate(distance=Distance('coordinates', center_point))
             nearby_spots = self.apply_filters(nearby_spots)
 
-            serializer = KebabSpotListSerializer(nearby_spots, many=True, context={'request': request})
-            return Response({
+            cache_key = response_cache_key('search', request, lat, lon, float(radius), location=place.name)
+            etag = quote_etag(cache_key)
+            response = not_modified(request, etag)
+            if response is not None:
+                return set_validators(response, etag)
+            content = get_cached_response(cache_key)
+            if content is not None:
+                return set_validators(geojson_response(content), etag)
+
+            paginator = DistanceKeysetPagination()
+            page = paginator.paginate_queryset(spot_rows(nearby_spots, 'distance'), request, view=self)
+            content = dumps({
                 # coordinates and name of town we searched
                 'location': {
-                    'name': data[0].get('name'),
+                    'name': place.name,
                     'lat': lat,
                     'lon': lon
                 },
-                # list of kebab spot objects
-                'spots': serializer.data
+                # list of kebab spot objects, nearest first
+                'spots': feature_collection(page),
+                'next': paginator.get_next_link()
             })
+            cache_response(cache_key, content)
+            return set_validators(geojson_response(content), etag)
 
         except requests.RequestException:
             return Response(
@@ -132,9 +236,342 @@ class SearchKebabSpotsAPIView(FiltersMixin, APIView):
             )
 
 
+class TextSearchKebabSpotsAPIView(FiltersMixin, APIView):
+    """
+    Spots by name or description: ?q=text, optionally only around lat/lon in radius (km).
+    A spot is found by full-text match of its words (search_vector) or by trigram similarity of the name,
+    so "kebap house" still finds "Kebab House". Both checks are answered from GIN indexes.
+    Spots are ordered by score: text relevance + bonus for rating - penalty for distance from the center.
+    """
+    authentication_classes = READ_ONLY_AUTHENTICATION
+    MIN_QUERY_LENGTH = 2
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 50
+    TEXT_WEIGHT = 1.0
+    RATING_WEIGHT = 0.2  # rating 5 adds this much
+    DISTANCE_WEIGHT = 0.3  # spot at the edge of the radius loses this much
+
+    def get(self, request):
+        text = self.request.query_params.get('q', '').strip()
+        if len(text) < self.MIN_QUERY_LENGTH:
+            raise ValidationError({'details': f'q must have at least {self.MIN_QUERY_LENGTH} characters'})
+        try:
+            limit = int(self.request.query_params.get('limit', self.DEFAULT_LIMIT))
+        except ValueError:
+            raise ValidationError({'details': 'limit must be integer'})
+        limit = min(max(limit, 1), self.MAX_LIMIT)
+
+        query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+        qs = KebabSpot.objects.filter(Q(search_vector=query) | Q(name__trigram_word_similar=text), hidden=False)
+        # both parts are between 0 and 1, the better one counts
+        qs = qs.annotate(relevance=Greatest(SearchRank(F('search_vector'), query), TrigramWordSimilarity(text, 'name')))
+        score = (self.TEXT_WEIGHT * F('relevance')
+                 + self.RATING_WEIGHT * Cast('average_rating', FloatField()) / 5)
+        extra = ('score',)
+
+        center = self.get_center()
+        if center is not None:
+            center_point, radius = center
+            qs = qs.filter(coordinates__distance_lte=(center_point, D(km=radius)))
+            qs = qs.annotate(distance=KNNDistance('coordinates', center_point))
+            score -= self.DISTANCE_WEIGHT * F('distance') / (radius * 1000)
+            extra += ('distance',)
+
+        qs = self.apply_filters(qs).annotate(score=score).order_by('-score', 'id')
+        rows = spot_rows(qs, *extra)[:limit]
+        return geojson_response(feature_collection(rows, properties=LIST_PROPERTIES + extra))
+
+    def get_center(self):
+        params = self.request.query_params
+        if params.get('lat') is None and params.get('lon') is None:
+            return None
+        try:
+            lat, lon = float(params.get('lat')), float(params.get('lon'))
+            radius = float(params.get('radius', 10))
+        except (ValueError, TypeError):
+            raise ValidationError({'details': 'lat/lon/radius must be numbers'})
+        if radius <= 0 or radius > 100:
+            raise ValidationError({'details': 'Radius must be between 0 and 100'})
+        return Point(lon, lat, srid=4326), radius
+
+
+class ClusterKebabSpotsAPIView(FiltersMixin, APIView):
+    """
+    Spots for the visible part of the map, given as bbox + zoom or as z/x/y tile.
+    On low zoom spots are grouped into grid cells by PostGIS, and every cell is returned
+    as one point with count, centroid and average rating. On high zoom real spots are returned.
+    Number of cells and spots is limited, so response size doesn't depend on size of the DB.
+    """
+    authentication_classes = READ_ONLY_AUTHENTICATION
+    CELLS_PER_TILE = 8  # cells along one side of 256px map tile
+    MAX_CELLS = 4096
+    MAX_CLUSTER_ZOOM = 14  # starting from this zoom spots are not clustered
+    MAX_SPOTS = 500
+
+    def get(self, request, z=None, x=None, y=None):
+        try:
+            if z is not None:
+                if not is_valid_tile(z, x, y):
+                    raise ValueError
+                zoom = z
+                west, south, east, north = tile_bounds(z, x, y)
+            else:
+                zoom = int(self.request.query_params.get('zoom', ''))
+                west, south, east, north = parse_bbox(self.request.query_params.get('bbox', ''))
+                if not 0 <= zoom <= MAX_ZOOM:
+                    raise ValueError
+        except (ValueError, TypeError):
+            raise ValidationError({'details': 'bbox=min_lon,min_lat,max_lon,max_lat and zoom or valid z/x/y are required'})
+
+        qs = self.filter_bbox(KebabSpot.objects.filter(hidden=False), west, south, east, north)
+        qs = self.apply_filters(qs)
+
+        if zoom >= self.MAX_CLUSTER_ZOOM:
+            spots = qs.order_by('-average_rating', 'id')[:self.MAX_SPOTS]
+            data = KebabSpotListSerializer(spots, many=True, context={'request': request}).data
+            return Response({**data, 'zoom': zoom, 'clustered': False})
+
+        return Response({
+            'type': 'FeatureCollection',
+            'zoom': zoom,
+            'clustered': True,
+            'features': [self.cluster_feature(cluster) for cluster in self.clusters(qs, zoom, west, south, east, north)]
+        })
+
+    def clusters(self, qs, zoom, west, south, east, north):
+        # size of cell in degrees, grows if bbox is so big that there would be too many cells
+        cell_size = 360 / (2 ** zoom * self.CELLS_PER_TILE)
+        cells = ((east - west) / cell_size) * ((north - south) / cell_size)
+        if cells > self.MAX_CELLS:
+            cell_size *= math.sqrt(cells / self.MAX_CELLS)
+
+        geometry = Cast('coordinates', output_field=gis_models.PointField(srid=4326))
+        lon = Func(geometry, function='ST_X', output_field=FloatField())
+        lat = Func(geometry, function='ST_Y', output_field=FloatField())
+
+        # whole grouping is done by DB, python gets one row per cell
+        return (
+            qs.annotate(
+                cell_x=Floor(lon / cell_size),
+                cell_y=Floor(lat / cell_size),
+            )
+            .values('cell_x', 'cell_y')
+            .annotate(
+                count=Count('id'),
+                spot_id=Min('id'),
+                lon=Avg(lon),
+                lat=Avg(lat),
+                rating=Avg('average_rating', filter=Q(ratings_count__gt=0)),
+            )
+            .order_by()
+        )
+
+    def cluster_feature(self, cluster):
+        properties = {
+            'cluster': cluster['count'] > 1,
+            'count': cluster['count'],
+            'average_rating': round(float(cluster['rating']), 1) if cluster['rating'] is not None else None,
+        }
+        if cluster['count'] == 1:
+            properties['id'] = cluster['spot_id']
+        return {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [cluster['lon'], cluster['lat']]},
+            'properties': properties
+        }
+
+
+class HeatmapKebabSpotsAPIView(APIView):
+    """
+    Spots count, average rating and amenities of grid cells in bbox, read only from RegionStats.
+    Without ?level= the most detailed level with not more than MAX_CELLS cells in bbox is used,
+    so the answer costs the same for a hundred or for millions of spots.
+    ?order=rating puts the best rated cells first (order=spots - the biggest ones).
+    """
+    authentication_classes = READ_ONLY_AUTHENTICATION
+    MAX_CELLS = 4096  # level 0 is never refused, the whole world is about 4200 cells of it
+    ORDERS = {
+        'spots': lambda stats: (-stats.spots_count, stats.x, stats.y),
+        'rating': lambda stats: (-(stats.average_rating or 0), -stats.ratings_count, stats.x, stats.y),
+    }
+
+    def get(self, request):
+        try:
+            west, south, east, north = parse_bbox(request.query_params.get('bbox', '-180,-90,180,90'))
+            level = request.query_params.get('level')
+            level = self.choose_level(west, south, east, north) if level is None else int(level)
+            if not 0 <= level < len(REGION_LEVELS):
+                raise ValueError
+        except (ValueError, TypeError):
+            raise ValidationError({'details': 'bbox=min_lon,min_lat,max_lon,max_lat and level '
+                                              f'0-{len(REGION_LEVELS) - 1} are expected'})
+        order = request.query_params.get('order', 'spots')
+        if order not in self.ORDERS:
+            raise ValidationError({'details': f"order must be one of: {', '.join(self.ORDERS)}"})
+
+        (min_x, min_y), (max_x, max_y) = self.cell_range(level, west, south, east, north)
+        if level and (max_x - min_x + 1) * (max_y - min_y + 1) > self.MAX_CELLS:
+            raise ValidationError({'details': 'Too many cells in bbox for this level, use a smaller level'})
+
+        cells = RegionStats.objects.filter(
+            level=level, x__gte=min_x, x__lte=max_x, y__gte=min_y, y__lte=max_y, spots_count__gt=0
+        )
+        return Response({
+            'type': 'FeatureCollection',
+            'level': level,
+            'cell_size': REGION_LEVELS[level],
+            'features': [self.cell_feature(stats) for stats in sorted(cells, key=self.ORDERS[order])],
+        })
+
+    def cell_range(self, level, west, south, east, north):
+        size = REGION_LEVELS[level]
+        return ((math.floor(west / size), math.floor(south / size)),
+                (math.floor(east / size), math.floor(north / size)))
+
+    def choose_level(self, west, south, east, north):
+        for level in reversed(range(len(REGION_LEVELS))):
+            (min_x, min_y), (max_x, max_y) = self.cell_range(level, west, south, east, north)
+            if (max_x - min_x + 1) * (max_y - min_y + 1) <= self.MAX_CELLS:
+                return level
+        return 0
+
+    def cell_feature(self, stats):
+        size = REGION_LEVELS[stats.level]
+        west, south = stats.x * size, stats.y * size
+        return {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[west, south], [west + size, south], [west + size, south + size],
+                                 [west, south + size], [west, south]]],
+            },
+            'properties': {
+                'count': stats.spots_count,
+                'rated_count': stats.rated_spots_count,
+                'ratings_count': stats.ratings_count,
+                'average_rating': stats.average_rating,
+                'amenities': dict(zip(AMENITIES, stats.amenities_counts)),
+            },
+        }
+
+
+class KebabSpotTileAPIView(APIView):
+    """
+    Mapbox Vector Tile with spots, built completely by PostGIS (ST_AsMVT), python only passes the bytes.
+    Ready tiles are kept in cache, signal handlers drop them when a spot inside the tile changes.
+    """
+    authentication_classes = READ_ONLY_AUTHENTICATION
+    LAYER_NAME = 'spots'
+    MAX_AGE = 60  # seconds browsers and CDN may reuse the tile without asking
+    INDEXED_MIN_ZOOM = 2  # lower zoom tiles are bigger than the geography index can handle correctly
+
+    def get(self, request, z, x, y):
+        if not is_valid_tile(z, x, y):
+            raise ValidationError({'details': 'Tile is out of range'})
+
+        tile = get_cached_tile(z, x, y)
+        if tile is None:
+            tile = self.build_tile(z, x, y)
+            cache_tile(z, x, y, tile)
+
+        response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        patch_cache_control(response, public=True, max_age=self.MAX_AGE)
+        return response
+
+    def build_tile(self, z, x, y):
+        table = KebabSpot._meta.db_table
+        # "fishing,toilet" - names of amenities the spot has
+        amenities = ', '.join(f"CASE WHEN s.{amenity} THEN '{amenity}' END" for amenity in FiltersMixin.AMENITIES)
+
+        where = 'NOT s.hidden AND ST_Intersects(ST_Transform(s.coordinates::geometry, 3857), bounds.geom)'
+        if z >= self.INDEXED_MIN_ZOOM:
+            # the same condition, written so the spatial index on the geography column can be used
+            where += (' AND s.coordinates && '
+                      'ST_Segmentize(ST_Expand(ST_Transform(bounds.geom, 4326), 0.05), 1)::geography')
+
+        sql = f"""
+            WITH bounds AS (SELECT ST_TileEnvelope(%s, %s, %s) AS geom),
+            features AS (
+                SELECT ST_AsMVTGeom(ST_Transform(s.coordinates::geometry, 3857), bounds.geom) AS geom,
+                       s.id, s.name, s.average_rating::float8 AS average_rating,
+                       concat_ws(',', {amenities}) AS amenities
+                FROM {table} s, bounds
+                WHERE {where}
+            )
+            SELECT ST_AsMVT(features, %s, 4096, 'geom', 'id') FROM features
+        """
+        # raw SQL is not routed automatically, ask the router like the ORM does
+        with connections[router.db_for_read(KebabSpot)].cursor() as cursor:
+            cursor.execute(sql, [z, x, y, self.LAYER_NAME])
+            row = cursor.fetchone()
+        return bytes(row[0]) if row and row[0] is not None else b''
+
+
+class ChangesKebabSpotAPIView(APIView):
+    """
+    Delta sync: ?since=<token> returns spots changed after the token.
+    "changed" - current state of new/edited spots, "deleted" - ids of deleted or hidden spots.
+    Client keeps the returned token for the next call, and calls again at once while "more" is true.
+    Without since all spots are returned (first sync).
+    """
+    authentication_classes = READ_ONLY_AUTHENTICATION
+    MAX_CHANGES = 1000
+
+    def get(self, request):
+        try:
+            txid, change_id = (int(part) for part in request.query_params.get('since', '0.0').split('.'))
+        except ValueError:
+            return Response({'error': 'Invalid since token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # snapshot and rows must come from the same database (one replica, or primary)
+        db = router.db_for_read(KebabSpotChange)
+        with connections[db].cursor() as cursor:
+            # all transactions older than this one are finished, their changes can't appear later
+            cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            finished_before = cursor.fetchone()[0]
+
+        changes = list(
+            KebabSpotChange.objects.using(db)
+            .filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=change_id), txid__lt=finished_before)
+            .order_by('txid', 'id')
+            .values_list('txid', 'id', 'spot_id')[:self.MAX_CHANGES + 1]
+        )
+        more = len(changes) > self.MAX_CHANGES
+        changes = changes[:self.MAX_CHANGES]
+        if changes:
+            txid, change_id, _ = changes[-1]
+
+        spot_ids = {spot_id for _, _, spot_id in changes}
+        rows = list(spot_rows(KebabSpot.objects.using(db).filter(id__in=spot_ids, hidden=False).order_by('id')))
+        deleted = sorted(spot_ids - {row['id'] for row in rows})
+        return geojson_response({
+            'token': f'{txid}.{change_id}',
+            'more': more,
+            'changed': feature_collection(rows),
+            'deleted': deleted,
+        })
+
+
+class GeocodingStatsAPIView(APIView):
+    """Cache hit/miss counters of the geocoder in this worker process."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(geocoding_stats())
+
+
+class ResponseCacheStatsAPIView(APIView):
+    """Hits, misses and invalidated cells of the list/search response cache in this worker process."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache_stats())
+
+
 class CreateKebabSpotAPIView(CheckPhotosMixin, generics.CreateAPIView):
     serializer_class = KebabSpotDetailSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'create_spot'
     queryset = KebabSpot.objects.all()
 
     def perform_create(self, serializer):
@@ -149,18 +586,38 @@ class CreateKebabSpotAPIView(CheckPhotosMixin, generics.CreateAPIView):
 
 
 class DetailsKebabSpotAPIView(generics.RetrieveAPIView):
+    """Answers If-None-Match / If-Modified-Since with 304 before the serializer is run."""
+    authentication_classes = READ_ONLY_AUTHENTICATION
     serializer_class = KebabSpotDetailSerializer
     queryset = KebabSpot.objects.all()
 
+    def get_queryset(self):
+        return with_details(super().get_queryset(), self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        # ETag needs only version and updated_at, the spot with photos is loaded only if the client's copy is old
+        stamp = get_object_or_404(KebabSpot.objects.values('version', 'updated_at'), pk=kwargs[self.lookup_field])
+        etag = spot_etag(kwargs[self.lookup_field], stamp['version'], stamp['updated_at'], request.user)
+        last_modified = int(stamp['updated_at'].timestamp())
+
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            spot = self.get_object()
+            # validators of the loaded version, it may be newer than the stamp
+            etag = spot_etag(spot.pk, spot.version, spot.updated_at, request.user)
+            last_modified = int(spot.updated_at.timestamp())
+            response = Response(self.get_serializer(spot).data)
+        return set_validators(response, etag, last_modified)
+
 
 class UpdateKebabSpotAPIView(CheckPhotosMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = KebabSpotDetailSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return KebabSpot.objects.filter(
+        return with_details(KebabSpot.objects.filter(
             user=self.request.user
-        )
+        ), self.request.user)
 
     def perform_update(self, serializer):
         photos = self.get_photos()
@@ -169,7 +626,8 @@ class UpdateKebabSpotAPIView(CheckPhotosMixin, generics.RetrieveUpdateDestroyAPI
         if photos:
             self.validate_photos(photos, spot)
 
-        spot = serializer.save(user=self.request.user)  # creating the spot
+        # only the edited fields are saved (KebabSpotDetailSerializer.update), so votes made meanwhile stay
+        spot = serializer.save(user=self.request.user)
 
         self.save_photos(spot, photos)
 
@@ -184,6 +642,7 @@ class DeleteKebabSpotPhotoAPIView(generics.DestroyAPIView):
 
 class RateKebabSpotAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'rate'
 
     def post(self, request, pk):
         spot = get_object_or_404(KebabSpot, pk=pk)
@@ -205,16 +664,23 @@ class RateKebabSpotAPIView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        rating, created = KebabSpotRating.objects.get_or_create(
-            spot=spot,
-            user=self.request.user,
-            defaults={'value': rating_value}
-        )
-        if not created:
-            rating.value = rating_value
-            rating.save()
+        with transaction.atomic():
+            # locked, so two requests of the same user can't both count the difference from the same old value
+            rating, created = KebabSpotRating.objects.select_for_update().get_or_create(
+                spot=spot,
+                user=self.request.user,
+                defaults={'value': rating_value}
+            )
+            delta = rating_value if created else rating_value - rating.value
+            if not created and delta:
+                rating.value = rating_value
+                rating.save(update_fields=['value'])
+
+            if created or delta:
+                spot.apply_rating_change(delta, 1 if created else 0)
 
-        spot.update_rating()
+        if created or delta:
+            spot_changed.send(sender=KebabSpot, spot=spot)
 
         return Response({
             'message': f'Thank you for your review! Your rating of this spot is {rating_value}.',
@@ -227,20 +693,25 @@ class RateKebabSpotAPIView(APIView):
 class ComplaintKebabSpotAPIView(generics.CreateAPIView):
     serializer_class = KebabSpotComplaintSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'complaint'
 
     def perform_create(self, serializer):
         spot = get_object_or_404(KebabSpot, pk=self.kwargs['pk'])
 
-        complaint, created = KebabSpotComplaint.objects.get_or_create(
-            spot=spot,
-            user=self.request.user,
-            defaults={
-                'reason': serializer.validated_data.get('reason', '')
-            }
-        )
-        if not created:
-            raise ValidationError("You already send complaint on this spot")
-
-        if spot.complaints.count() >= 5:
-            spot.hidden = True
-            spot.save(update_fields=['hidden'])
+        with transaction.atomic():
+            # unique (spot, user): of two equal requests only one creates the complaint
+            complaint, created = KebabSpotComplaint.objects.get_or_create(
+                spot=spot,
+                user=self.request.user,
+                defaults={
+                    'reason': serializer.validated_data.get('reason', '')
+                }
+            )
+            if not created:
+                raise ValidationError("You already send complaint on this spot")
+            # complaints are counted in the spot row, no COUNT over all complaints
+            hidden_now = spot.add_complaint()
+
+        if hidden_now:
+            # hidden spot disappears from lists, tiles and sync
+            spot_changed.send(sender=KebabSpot, spot=spot)
@@ -121,6 +121,7 @@ const Map = () => {
         lat: coordinates.lat,
         lon: coordinates.lon,
         radius: radius,
+        page_size: 500,
       };
       if (rating) {
         params.min_rating = rating;
@@ -130,10 +131,16 @@ const Map = () => {
           params[key] = "true";
         }
       });
-      const result = await publicApiClient.get("kebab_spots/spots/", {
+      let result = await publicApiClient.get("kebab_spots/spots/", {
         params,
       });
-      setSpots(result.data.features || []);
+      let features = result.data.features || [];
+      // the list is paginated, the map shows every spot in the radius
+      while (result.data.next) {
+        result = await publicApiClient.get(result.data.next);
+        features = features.concat(result.data.features || []);
+      }
+      setSpots(features);
     } catch (error) {
       console.error("Error in useEffect which loads points", error);
     }
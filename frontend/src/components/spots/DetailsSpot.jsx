@@ -222,7 +222,7 @@ const DetailsSpot = () => {
           <div className="spot-photos">
             <h3>Photos</h3>
             <div className="photos-grid">
-              {spot.properties.photos.map((photo) => (
+              {spot.properties.photos.filter((photo) => photo.photo).map((photo) => (
                 <a
                   href={photo.photo}
                   key={photo.id}
@@ -230,7 +230,7 @@ const DetailsSpot = () => {
                   rel="noopener noreferer"
                 >
                   <img
-                    src={photo.photo}
+                    src={photo.thumbnail || photo.photo}
                     alt={`Photo of  ${spot.properties.name}`}
                   />
                 </a>
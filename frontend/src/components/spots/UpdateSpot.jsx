@@ -333,7 +333,7 @@ const UpdateSpot = () => {
                     rel="noopener noreferrer"
                   >
                     <img
-                      src={photo.photo}
+                      src={photo.thumbnail || photo.photo}
                       alt={`Photo of ${spotData.properties.name}`}
                     />
                   </a>
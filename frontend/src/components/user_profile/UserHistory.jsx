@@ -11,7 +11,7 @@ const UserHistory = () => {
   const fetchSpotsHistory = async () => {
     try {
       const response = await privateApiClient.get("auth/user_history/");
-      setSpotsList(response.data);
+      setSpotsList(response.data.results);
     } catch (error) {
       if (error.response?.status === 401) {
         navigate("/login")